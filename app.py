@@ -1,11 +1,186 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-from functions_product import read_df_product, clean_df_product, consume_wine, consume_m_w_by_age, consume_men_women, consume_by_age
-from functions_marketing import read_df_marketing, clean_df_marketing, site_purchases_by_age, site_purchases_by_income, web_visits_by_age, purchases_by_income, purchases_by_income_line, purchases_by_education, son_at_home, purchases_by_living_status, purchases_by_month
-from functions_click import read_df_click, clean_df_click, click_by_category, click_by_category_income, click_by_category_age
+from functions_cache import load_product, load_marketing, load_marketing_index, load_click_cube, load_appended_clicks, load_async, cache_stats
+from functions_index import filter_ranges
+from functions_render import render_chart, render_stats
+from functions_shared import shared_stats
+from functions_profile import PROFILE_MODES, timed, profile_rerun
+from functions_vega import CHART_BACKEND, vega_spec
+from functions_duckdb import QUERY_BACKEND, marketing_table, click_table, column_bounds, select_rows, marketing_aggregates, click_counts
+from functions_product import product_table, consume_wine, consume_m_w_by_age, consume_men_women, consume_by_age
+from functions_marketing import aggregate_marketing, linear_fit, site_purchases_by_age, site_purchases_by_income, web_visits_by_age, purchases_by_income, purchases_by_income_line, purchases_by_education, son_at_home, purchases_by_living_status, purchases_by_month, COHORT_VIEWS
+from functions_click import slice_click_cube, click_by_category, click_by_category_income, click_by_category_age
+
+
+def show_chart(func, *args):
+    """
+    Shows the chart drawn by func(*args) with the chart backend of the
+    deployment (CHART_BACKEND): a Vega-Lite chart drawn in the browser, or
+    the PNG rendered by matplotlib on the server.
+    """
+    if CHART_BACKEND == 'vega':
+        with timed('plot', func.__name__):
+            spec = vega_spec(func, *args)
+        if spec is not None:
+            st.vega_lite_chart(spec, width='stretch')
+            return
+    st.image(render_chart(func, *args), width='stretch')
+
+
+def wait_for(future, name):
+    """
+    Returns the dataset loaded in the background by future (see load_async),
+    with a spinner while it is not ready yet. The wait is timed for the
+    profiling panel, next to the read and clean stages of the loading thread.
+    """
+    with timed('load', f'wait {name}'), st.spinner(f'Loading the {name} data...'):
+        return future.result()
+
+
+def load_marketing_source():
+    """
+    Returns the marketing data queried by the app with the query backend of the
+    deployment (QUERY_BACKEND): the path of its Parquet table for DuckDB, or
+    the cleaned DataFrame with its range index.
+    """
+    if QUERY_BACKEND == 'duckdb':
+        return {'table': marketing_table()}
+    return {'df': load_marketing(), 'index': load_marketing_index()}
+
+
+def select_marketing(marketing, columns, ranges):
+    """
+    Returns the columns of the customers with every column of ranges strictly inside its range.
+    """
+    with timed('filter', 'select_marketing'):
+        if 'table' in marketing:
+            return select_rows(marketing['table'], columns, ranges)
+        return filter_ranges(marketing['df'], marketing['index'], ranges)[columns]
+
+
+def aggregate_wine(marketing, wine_range):
+    """
+    Returns the groupings of the marketing charts for the customers inside wine_range
+    (see aggregate_marketing), computed by DuckDB or over the filtered DataFrame.
+    """
+    if 'table' in marketing:
+        with timed('aggregate', 'marketing_aggregates'):
+            return marketing_aggregates(marketing['table'], wine_range)
+    with timed('filter', 'filter_ranges'):
+        df_wine = filter_ranges(marketing['df'], marketing['index'], {'MntWines': wine_range})
+    with timed('aggregate', 'aggregate_marketing'):
+        return aggregate_marketing(df_wine)
+
+
+def load_click_source():
+    """
+    Returns the click data queried by the app: the path of its Parquet table
+    for DuckDB with the count cube of the appended batches, or the count cube
+    of all the clicks (see build_click_cube and append_clicks).
+    """
+    if QUERY_BACKEND == 'duckdb':
+        return {'table': click_table(), 'appended': load_appended_clicks()}
+    return {'cube': load_click_cube()}
+
+
+def count_clicks(click, income_range=None, age_range=None):
+    """
+    Returns the counts frame of the clicks inside the income and age ranges (see slice_click_cube).
+    """
+    with timed('filter', 'count_clicks'):
+        if 'table' in click:
+            counts = click_counts(click['table'], income_range, age_range)
+            if click['appended'] is not None:
+                # The counts frames are added up by the charts, which sum 'Count' by group
+                counts = pd.concat([counts, slice_click_cube(click['appended'], income_range, age_range)], ignore_index=True)
+            return counts
+        return slice_click_cube(click['cube'], income_range, age_range)
+
+
+@st.fragment
+def consume_wine_block(df_both):
+    """
+    Pie chart of consumers/not consumers for the selected age range.
+    Runs as a fragment, so changing the age range only reruns this block.
+    """
+    age_filter1 = st.selectbox("Select age range", df_both.index)
+    filtered_wine = df_both.loc[[age_filter1]]
+    show_chart(consume_wine, filtered_wine)
+
+
+@st.fragment
+def consume_by_age_block(df_both):
+    """
+    Bar chart of consumers for the selected age ranges. Runs as a fragment.
+    """
+    age_filter2 = st.multiselect("Select age range", df_both.index)
+    filtered_wine = df_both.loc[[age for age in df_both.index if age in age_filter2]]
+    show_chart(consume_by_age, filtered_wine)
+
+
+@st.fragment
+def consume_by_genre_block(df_men, df_women):
+    """
+    Line chart of consumers by age for the selected genre. Runs as a fragment.
+    """
+    genre_filter = st.radio("Select genre", ['Both', 'Men', 'Women'])
+    
+    if genre_filter=='Both':
+        show_chart(consume_m_w_by_age, df_men, df_women, 0)
+    elif genre_filter=='Men':
+        show_chart(consume_m_w_by_age, df_men, df_women, 1)
+    elif genre_filter=='Women':
+        show_chart(consume_m_w_by_age, df_men, df_women, 2)
+
+
+@st.fragment
+def purchases_by_income_block(marketing, wine_range):
+    """
+    Scatter plot of wine purchases for the selected wine and income ranges,
+    with an optional linear fit whose coefficients are shown below it. Runs as
+    a fragment, so moving the income slider or ticking the checkbox does not
+    redraw the rest of the marketing study. Both ranges are looked up in the
+    sorted index of the marketing data (see functions_index), or in its
+    Parquet table with the DuckDB backend.
+    """
+    income_range = st.slider('Select range income', 6000.0, 110000.0, value=[6000.0, 110000.0])
+    df_income = select_marketing(marketing, ['Income', 'MntWines'], {'MntWines': wine_range, 'Income': income_range})
+    adjust = st.checkbox('Linear fit')
+
+    st.write('#### Purchases by income')
+    if adjust == False:
+        show_chart(purchases_by_income, df_income)
+    else:
+        show_chart(purchases_by_income_line, df_income)
+        fit = linear_fit(df_income['Income'], df_income['MntWines'])
+        if fit is not None:
+            st.caption(f"Slope {fit['slope']:.4f} · intercept {fit['intercept']:.1f} · R² {fit['r2']:.3f} · {fit['n']} customers")
+
+
+@st.fragment
+def purchases_by_month_block(wine_aggregates):
+    """
+    Wine purchases by enrollment date in the selected view. Runs as a fragment:
+    changing the view re-buckets the daily cohorts of the aggregates without
+    going through the customers again.
+    """
+    view = st.radio('Select view', COHORT_VIEWS, horizontal=True)
+    show_chart(purchases_by_month, wine_aggregates, view)
+
+
+@st.fragment
+def click_by_category_block(filtered2_click):
+    """
+    Bar chart of clicks by category with the selected zoom. Runs as a fragment.
+    """
+    # With the Vega-Lite backend the chart is zoomed in the browser
+    if CHART_BACKEND == 'vega':
+        zoom_range = [20, 70]
+    else:
+        zoom_range = st.slider('Select size zoom', 20, 70, value=[20, 70])
+
+    st.write('#### Percentage click by category')
+    show_chart(click_by_category, filtered2_click, zoom_range)
 
 
 def main():
@@ -14,6 +189,10 @@ def main():
     functionality of the app.
 
     The app is divided into three sections: Wine Consumption Study, Marketing Study and Click Study.
+    The chart blocks with their own widgets are fragments that rerun alone when
+    those widgets change; the sidebar filters and the conclusions rerun the whole
+    app, which reuses the cached data and charts of the unchanged blocks.
+    The three datasets are loaded concurrently from the start of the rerun.
     """
 
     st.title('Data-Analysis marketing strategy for a wine company')
@@ -23,13 +202,18 @@ def main():
     st.write('##### Understanding the most popular purchasing channels: We will assess whether customers prefer to buy in physical stores, through catalogs, or online. This information will help direct marketing efforts toward the most effective sales channels.')
     st.write('##### Optimizing ad click-through rates: By analyzing consumer interests (fashion, technology, travel, sports, etc.), we will identify which types of ads generate the highest engagement and clicks, especially across different income groups. This will allow us to create compelling ads that resonate with the target audience.')
     
+    # Start loading the three datasets at once; each section waits only for its own
+    product_loading = load_async(load_product)
+    marketing_loading = load_async(load_marketing_source)
+    click_loading = load_async(load_click_source)
+
     ######################## Wine Consumption Section #############################################
     
     st.divider()
     total_conclusions1 = []
-    # Load data 
-    df_product = read_df_product()
-    df_both, df_men, df_women = clean_df_product(df_product)
+    # Load data (cleaned tables are cached on disk, see functions_cache)
+    product_store = wait_for(product_loading, 'wine consume')
+    df_both, df_men, df_women = (product_table(product_store, sex) for sex in ['Both', 'Men', 'Women'])
 
     st.title('Wine consume study')
     st.page_link('https://www.ine.es/jaxi/Tabla.htm?path=/t15/p419/p02/a2003/l0/&file=02086.px&L=0', label='Wine consume Dataset from INEbase', icon="🍷")
@@ -38,41 +222,24 @@ def main():
 
     # By age
     st.write('#### Percentage spanish people >16 consumers/not consumers')
-    age_filter1 = st.selectbox("Select age range", df_both['years'].unique())
-    filtered_wine = df_both[df_both['years'] == age_filter1]
-    plt = consume_wine(filtered_wine)
-    st.pyplot(plt)
+    consume_wine_block(df_both)
 
     c1 = st.text_input('Conclusion 1: ')
     total_conclusions1.append(c1)
 
 
     st.write('#### Percentage of spanish people who consumes wine by age')
-    age_filter2 = st.multiselect("Select age range", df_both['years'].unique())
-    filtered_wine = df_both[df_both['years'].isin(age_filter2)]
-    plt = consume_by_age(filtered_wine)
-    st.pyplot(plt)
+    consume_by_age_block(df_both)
 
     c2 = st.text_input('Conclusion 2: ')
     total_conclusions1.append(c2)
 
     # By genre
     st.write('#### Percentage consumers by genres')
-    genre_filter = st.radio("Select genre", ['Both', 'Men', 'Women'])
-    
-    if genre_filter=='Both':
-        plt = consume_m_w_by_age(df_men, df_women, 0)
-        st.pyplot(plt)
-    elif genre_filter=='Men':
-        plt = consume_m_w_by_age(df_men, df_women, 1)
-        st.pyplot(plt)
-    elif genre_filter=='Women':
-        plt = consume_m_w_by_age(df_men, df_women, 2)
-        st.pyplot(plt)
+    consume_by_genre_block(df_men, df_women)
 
     st.write('#### Comparing both percentage of total consumers')
-    plt = consume_men_women(df_men, df_women)
-    st.pyplot(plt)
+    show_chart(consume_men_women, df_men, df_women)
 
     c3 = st.text_input('Conclusion 3: ')
     total_conclusions1.append(c3)
@@ -92,8 +259,7 @@ def main():
     st.divider()
     total_conclusions2 = []
     # Load data 
-    df_marketing = read_df_marketing()
-    df_marketing = clean_df_marketing(df_marketing)
+    marketing = wait_for(marketing_loading, 'marketing')
 
     st.title('Marketing Study')
     st.page_link('https://www.kaggle.com/datasets/rodsaldanha/arketing-campaign', label='Marketing campaign Dataset from Kaggle', icon="🛍️")
@@ -101,18 +267,22 @@ def main():
     st.sidebar.divider()
     st.sidebar.header("Filters marketing study")
 
-    wine_range = st.sidebar.slider('Select range of total amount spent on wine', value=[df_marketing['MntWines'].min(), df_marketing['MntWines'].max()])
-    df_wine = df_marketing[(df_marketing['MntWines']>wine_range[0]) & (df_marketing['MntWines']<wine_range[1])]
+    if 'table' in marketing:
+        wine_bounds = column_bounds(marketing['table'], 'MntWines')
+    else:
+        wine_bounds = [marketing['df']['MntWines'].min(), marketing['df']['MntWines'].max()]
+    wine_range = st.sidebar.slider('Select range of total amount spent on wine', value=wine_bounds)
+
+    # Groupings of all the charts below, computed in one pass over the filtered rows
+    wine_aggregates = aggregate_wine(marketing, wine_range)
 
     st.write('#### Average purchases by age and different channel')
-    plt = site_purchases_by_age(df_wine)
-    st.pyplot(plt)
+    show_chart(site_purchases_by_age, wine_aggregates)
     c4 = st.text_input('Conclusion 4: ')
     total_conclusions2.append(c4)
 
     st.write('#### Average purchases by income and different channel')
-    plt = site_purchases_by_income(df_wine)
-    st.pyplot(plt)
+    show_chart(site_purchases_by_income, wine_aggregates)
 
     c5 = st.text_input('Conclusion 5: ')
     total_conclusions2.append(c5) 
@@ -121,55 +291,40 @@ def main():
 
 
     st.write('#### Average visits in the website by age')
-    plt = web_visits_by_age(df_wine)
-    st.pyplot(plt)
+    show_chart(web_visits_by_age, wine_aggregates)
     c7 = st.text_input('Conclusion 7: ')
     total_conclusions2.append(c7)
     
 
-    income_range = st.slider('Select range income', 6000.0, 110000.0, value=[6000.0, 110000.0])
-    df_income = df_wine[(df_wine['Income']>income_range[0]) & (df_wine['Income']<income_range[1])]
-    adjust = st.checkbox('Linear fit')
-
-    st.write('#### Purchases by income')
-    if adjust == False:
-        plt = purchases_by_income(df_income)
-        st.pyplot(plt)
-    else:
-        plt = purchases_by_income_line(df_income)
-        st.pyplot(plt)
+    purchases_by_income_block(marketing, wine_range)
 
     c8 = st.text_input('Conclusion 8: ')
     total_conclusions2.append(c8)
 
 
     st.write('#### Average wine purchases by education')
-    plt = purchases_by_education(df_wine)
-    st.pyplot(plt)
+    show_chart(purchases_by_education, wine_aggregates)
 
     c9 = st.text_input('Conclusion 9: ')
     total_conclusions2.append(c9)
 
 
     st.write('#### Percentage wine purchases with son or without son at home')
-    plt = son_at_home(df_wine)
-    st.pyplot(plt)
+    show_chart(son_at_home, wine_aggregates)
 
     c10 = st.text_input('Conclusion 10: ')
     total_conclusions2.append(c10)
 
 
     st.write('#### Average wine purchases by living status')
-    plt = purchases_by_living_status(df_wine)
-    st.pyplot(plt)
+    show_chart(purchases_by_living_status, wine_aggregates)
 
     c11 = st.text_input('Conclusion 11: ')
     total_conclusions2.append(c11)
 
 
     st.write('#### Total wine purchases by month')
-    plt = purchases_by_month(df_wine)
-    st.pyplot(plt)
+    purchases_by_month_block(wine_aggregates)
 
     c12 = st.text_input('Conclusion 12: ')
     total_conclusions2.append(c12)
@@ -187,9 +342,8 @@ def main():
     
     st.divider()
     total_conclusions3 = []
-    # Load data 
-    df_click = read_df_click()
-    df_click = clean_df_click(df_click)
+    # Load data (the count cube, or DuckDB, answers the income and age filters)
+    click = wait_for(click_loading, 'click')
 
     st.title('Click Study')
     st.page_link('https://www.kaggle.com/datasets/natchananprabhong/online-ad-click-prediction-dataset', label='Ad Click Prediction Dataset from Kaggle', icon="📣")
@@ -197,33 +351,27 @@ def main():
     st.sidebar.divider()
     st.sidebar.header("Filters click study")
 
-    income_rng = st.sidebar.slider('Select range income', 20000.0, 100000.0, value=[20000.0, 100000.0])
-    filtered_click = df_click[(df_click['Income']>income_rng[0]) & (df_click['Income']<income_rng[1])]
+    income_rng = st.sidebar.slider('Select range income', 20000.0, 100000.0, value=[20000.0, 100000.0], step=1000.0)
+    filtered_click = count_clicks(click, income_rng)
 
-    age_rng = st.sidebar.slider('Select range age', 16, 64, value=[16, 64])
-    filtered2_click = filtered_click[(filtered_click['Age']>age_rng[0]) & (filtered_click['Age']<age_rng[1])]
+    age_rng = st.sidebar.slider('Select range age', 16, 64, value=[16, 64], step=1)
+    filtered2_click = count_clicks(click, income_rng, age_rng)
 
-    zoom_range = st.slider('Select size zoom', 20, 70, value=[20, 70])
-    
-    st.write('#### Percentage click by category')
-    plt = click_by_category(filtered2_click, zoom_range)
-    st.pyplot(plt)
+    click_by_category_block(filtered2_click)
 
     c13 = st.text_input('Conclusion 13: ')
     total_conclusions3.append(c13)
 
 
     st.write('#### Percentage click by category and income')
-    plt = click_by_category_income(filtered2_click)
-    st.pyplot(plt)
+    show_chart(click_by_category_income, filtered2_click)
 
     c14 = st.text_input('Conclusion 14: ')
     total_conclusions3.append(c14)
 
 
     st.write('#### Percentage click by category and age')
-    plt = click_by_category_age(filtered_click)
-    st.pyplot(plt)
+    show_chart(click_by_category_age, filtered_click)
 
     c15 = st.text_input('Conclusion 15: ')
     total_conclusions3.append(c15)
@@ -248,7 +396,48 @@ def main():
         if conclusion != '':
             st.write(f'##### - {conclusion}')
 
+    # Data and chart cache usage of this server process, and of the store shared by every process
+    stats = cache_stats()
+    st.sidebar.divider()
+    st.sidebar.caption(f"Data cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries ({stats['bytes'] / 1e6:.1f} MB)")
+    stats = render_stats()
+    st.sidebar.caption(f"Chart cache: {stats['hits']} hits, {stats['misses']} misses, {stats['charts']} charts ({stats['bytes'] / 1e6:.1f} MB)")
+    stats = shared_stats()
+    st.sidebar.caption(f"Shared store: {stats['entries']} entries ({stats['bytes'] / 1e6:.1f} MB)")
+
+
+
+def profiling_panel(capture):
+    """
+    Sidebar panel to choose the profiling mode of the next reruns and show
+    the timings of the current one, with the profiler capture to download.
+    The timings of the fragments rerunning alone are not included.
+    """
+    with st.sidebar.expander('Performance'):
+        st.radio('Profiling', PROFILE_MODES, key='profiling', horizontal=True)
+        if capture['timings'] is None:
+            return
+
+        st.caption(f"Rerun: {capture['seconds'] * 1000:.0f} ms")
+        timings = pd.DataFrame(capture['timings'], columns=['stage', 'name', 'ms'])
+        st.dataframe(timings.groupby('stage', sort=False)['ms'].sum().round(1).reset_index(), hide_index=True)
+        st.dataframe(timings.round({'ms': 1}), hide_index=True)
+        if capture['error']:
+            st.caption(f"Profiler not started: {capture['error']}")
+        if capture['pstats']:
+            st.download_button('Download pstats', capture['pstats'], file_name='rerun.pstats', on_click='ignore')
+        if capture['folded']:
+            st.download_button('Download flamegraph stacks', capture['folded'], file_name='rerun.folded', on_click='ignore')
+
+
+def run():
+    """
+    Runs the app, profiled as selected in the performance panel of the sidebar.
+    """
+    with profile_rerun(st.session_state.get('profiling', 'Off')) as capture:
+        main()
+    profiling_panel(capture)
+
 
-    
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
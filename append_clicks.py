@@ -0,0 +1,31 @@
+import sys
+import time
+import argparse
+import pandas as pd
+from functions_click import CLICK_COLUMNS, CLICK_APPEND_PATH, append_clicks, slice_click_cube
+
+
+def main(argv=None):
+    """
+    Appends CSV batches of ad clicks to the click study (see append_clicks)
+    and prints the rows and time of every batch and the appended totals.
+    """
+    parser = argparse.ArgumentParser(description='Append batches of ad clicks to the click study without rebuilding it.')
+    parser.add_argument('batches', nargs='+', help='CSV files with the columns of adsclicking.csv')
+    parser.add_argument('--output', default=CLICK_APPEND_PATH, help=f'File with the appended counts (default {CLICK_APPEND_PATH})')
+    args = parser.parse_args(argv)
+
+    for path in args.batches:
+        start = time.perf_counter()
+        df = pd.read_csv(path, usecols=CLICK_COLUMNS)
+        cube = append_clicks(df, args.output)
+        print(f'{path}: {len(df)} rows appended in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    counts = slice_click_cube(cube)
+    clicks = counts.loc[counts['Click'] == 1, 'Count'].sum()
+    print(f'Appended in total: {counts["Count"].sum()} rows, {clicks} clicks ({args.output})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
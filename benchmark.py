@@ -0,0 +1,338 @@
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import functions_snapshot
+from generate_data import generate
+from functions_render import SAVEFIG_OPTIONS
+from functions_report import chart_plan
+from functions_product import PRODUCT_PATH, read_df_product, clean_df_product, product_table
+from functions_marketing import MARKETING_PATH, read_df_marketing, clean_df_marketing, aggregate_marketing
+from functions_click import CLICK_PATH, read_df_click, clean_df_click, build_click_cube, slice_click_cube
+
+
+# Files where the results of every run are appended and where the reference timings are kept
+HISTORY_PATH = 'benchmarks/history.jsonl'
+BASELINE_PATH = 'benchmarks/baseline.json'
+
+# A stage is flagged as a regression when it is this much slower than the baseline,
+# and at least ABSOLUTE_FLOOR seconds slower (below it the difference is noise)
+TOLERANCE = 0.25
+ABSOLUTE_FLOOR = 0.01
+
+# Timed runs of each stage, after one warm-up run (the fastest one is kept)
+REPEAT = 5
+
+# Key of the calibration workload in the results, which measures the speed of the machine
+CALIBRATION = {'scale': 0, 'study': 'machine', 'stage': 'calibration', 'name': 'calibration_workload', 'rows': 0}
+
+
+def write_scaled_sources(folder, scale, synthetic=False):
+    """
+    Writes the marketing and click datasets with their rows repeated scale
+    times into a folder, in the same format as the originals. The IDs of the
+    marketing copies are shifted so clean_df_marketing does not drop them as
+    duplicates. The INE table has a fixed size, so it is not scaled.
+
+    With synthetic=True the rows are drawn by generate_data instead of
+    repeated, so the scaled data keeps a realistic spread of values.
+
+    Returns a dict with the path of every dataset.
+    """
+    paths = {'product': PRODUCT_PATH}
+    if synthetic:
+        for study, source in [('marketing', MARKETING_PATH), ('click', CLICK_PATH)]:
+            paths[study] = os.path.join(folder, os.path.basename(source))
+        generate('marketing', len(pd.read_excel(MARKETING_PATH, usecols=[0])) * scale, paths['marketing'])
+        generate('click', len(pd.read_csv(CLICK_PATH, usecols=[0])) * scale, paths['click'])
+        return paths
+
+    df_marketing = pd.read_excel(MARKETING_PATH)
+    copies = []
+    for i in range(scale):
+        copy = df_marketing.copy()
+        copy['ID'] = copy['ID'] + i * (df_marketing['ID'].max() + 1)
+        copies.append(copy)
+    paths['marketing'] = os.path.join(folder, os.path.basename(MARKETING_PATH))
+    pd.concat(copies, ignore_index=True).to_excel(paths['marketing'], index=False)
+
+    df_click = pd.read_csv(CLICK_PATH)
+    paths['click'] = os.path.join(folder, os.path.basename(CLICK_PATH))
+    pd.concat([df_click] * scale, ignore_index=True).to_csv(paths['click'], index=False)
+
+    return paths
+
+
+def measure(func, repeat):
+    """
+    Calls func once to warm up the caches, then repeat times, and returns the
+    minimum time in seconds and the result of the last call. The minimum is
+    the run least disturbed by the rest of the machine.
+    """
+    result = func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+# Programs timed in a fresh interpreter by measure_startup: importing the app, and
+# importing it, loading the product study and rendering its first chart
+STARTUP_PROGRAMS = {
+    'import_app': 'import app',
+    'first_chart': ('import app\n'
+                    'from functions_cache import load_product\n'
+                    'from functions_render import render_chart\n'
+                    'from functions_product import consume_wine, product_table\n'
+                    "df_both = product_table(load_product(), 'Both')\n"
+                    "render_chart(consume_wine, df_both.loc[['Total']])"),
+}
+
+
+def measure_startup(repeat):
+    """
+    Times the cold start of the app: every program of STARTUP_PROGRAMS runs
+    repeat times in a new Python process, which reports the seconds it took
+    (the interpreter start itself is not included). A first run warms up the
+    bytecode and disk caches and the fastest of the others is kept.
+
+    Returns a list of result dicts.
+    """
+    results = []
+    for name, program in STARTUP_PROGRAMS.items():
+        code = f'import time\nstart = time.perf_counter()\n{program}\nprint(time.perf_counter() - start)'
+        times = []
+        for _ in range(repeat + 1):
+            output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            times.append(float(output.split()[-1]))
+        results.append({'scale': 1, 'study': 'app', 'stage': 'startup', 'name': name, 'rows': 0, 'seconds': min(times[1:])})
+    return results
+
+
+def run_scale(scale, repeat, folder, synthetic=False):
+    """
+    Times every stage of the three studies with the datasets repeated scale times.
+
+    The stages are:
+
+    - read: parsing the source file with read_df_*.
+    - read_snapshot: reading the memory-mapped Arrow snapshot of the file.
+    - clean: clean_df_*.
+    - aggregate: the tables of the product charts, the groupings of the marketing
+      charts, and building and slicing the count cube of the click study.
+    - plot: calling each chart function, which draws the aggregated data on a Figure
+      (the income charts still bin or fit the customers themselves).
+    - render: rasterising each Figure to PNG as the app does.
+
+    Returns a list of result dicts.
+    """
+    paths = write_scaled_sources(folder, scale, synthetic)
+    results = []
+
+    def record(study, stage, name, seconds, rows):
+        results.append({'scale': scale, 'synthetic': synthetic, 'study': study, 'stage': stage, 'name': name, 'rows': rows, 'seconds': seconds})
+
+    # Snapshots of the scaled files go to the temporary folder, never to datasets/
+    functions_snapshot.SNAPSHOT_DIR = os.path.join(folder, 'snapshots')
+    cleaned = {}
+    for study, read, clean in [('product', read_df_product, clean_df_product),
+                               ('marketing', read_df_marketing, clean_df_marketing),
+                               ('click', read_df_click, clean_df_click)]:
+        path = paths[study]
+        seconds, raw = measure(lambda: read(path), repeat)
+        record(study, 'read', read.__name__, seconds, len(raw))
+
+        functions_snapshot.write_snapshot(path)
+        seconds, raw = measure(lambda: read(path), repeat)
+        record(study, 'read_snapshot', read.__name__, seconds, len(raw))
+        os.remove(functions_snapshot.snapshot_path(path))
+
+        seconds, cleaned[study] = measure(lambda: clean(raw.copy()), repeat)
+        rows = len(cleaned[study])
+        record(study, 'clean', clean.__name__, seconds, rows)
+
+    seconds, _ = measure(lambda: [product_table(cleaned['product'], sex) for sex in ['Both', 'Men', 'Women']], repeat)
+    record('product', 'aggregate', 'product_table', seconds, len(cleaned['product']))
+    seconds, _ = measure(lambda: aggregate_marketing(cleaned['marketing']), repeat)
+    record('marketing', 'aggregate', 'aggregate_marketing', seconds, len(cleaned['marketing']))
+    seconds, cube = measure(lambda: build_click_cube(cleaned['click']), repeat)
+    record('click', 'aggregate', 'build_click_cube', seconds, len(cleaned['click']))
+    seconds, _ = measure(lambda: slice_click_cube(cube, [30000.0, 90000.0], [20, 60]), repeat)
+    record('click', 'aggregate', 'slice_click_cube', seconds, len(cleaned['click']))
+
+    # Plot and render every chart, in rounds over all the charts: a slow spell of
+    # the machine then slows down one run of many charts instead of every run of a
+    # few of them. The first round is the warm-up
+    plan = chart_plan(cleaned['product'], cleaned['marketing'], cube)
+    times = {(name, stage): [] for _, name, _, _ in plan for stage in ['plot', 'render']}
+    for i in range(repeat + 1):
+        for study, name, func, args in plan:
+            start = time.perf_counter()
+            fig = func(*args)
+            plotted = time.perf_counter()
+            fig.savefig(io.BytesIO(), **SAVEFIG_OPTIONS)
+            if i > 0:
+                times[(name, 'plot')].append(plotted - start)
+                times[(name, 'render')].append(time.perf_counter() - plotted)
+    for study, name, _, _ in plan:
+        rows = len(cleaned['marketing']) if study == 'marketing' else len(cleaned['click']) if study == 'click' else len(cleaned['product'])
+        for stage in ['plot', 'render']:
+            record(study, stage, name, min(times[(name, stage)]), rows)
+
+    return results
+
+
+def calibration_workload():
+    """
+    Fixed work that does not use the code of the app: sorting a million random
+    floats with numpy and summing a million squares in Python. Its time only
+    changes with the speed of the machine.
+    """
+    np.sort(np.random.default_rng(0).random(1_000_000))
+    return sum(i * i for i in range(1_000_000))
+
+
+def machine_drift(result, baseline):
+    """
+    Returns how much slower (above 1) or faster the machine ran the calibration
+    workload than when the baseline was saved, or None if the baseline has no
+    calibration. result is the calibration result of the current run.
+    """
+    reference = baseline.get(result_key(result))
+    return result['seconds'] / reference if reference else None
+
+
+def result_key(result):
+    """
+    Returns the key identifying a result in the baseline. The scales of synthetic
+    data end with 's', as their timings are not comparable with repeated copies.
+    """
+    return f"{result['study']}/{result['stage']}/{result['name']}@{result['scale']}{'s' if result.get('synthetic') else ''}"
+
+
+def read_baseline(path):
+    """
+    Returns the timings of the baseline file at path by result key, and whether
+    it was saved from synthetic data (None for a baseline saved without its mode).
+    Returns ({}, None) if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}, None
+    with open(path) as f:
+        baseline = json.load(f)
+    if 'timings' not in baseline:
+        return baseline, None
+    return baseline['timings'], baseline['synthetic']
+
+
+def git_commit():
+    """
+    Returns the current git commit of the repository, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """
+    Runs the benchmark, appends the results to the history file and
+    compares them with the baseline. Returns 1 if any stage regressed.
+    """
+    parser = argparse.ArgumentParser(description='Time the load, clean, aggregate and render stages of every study.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help='times the datasets are repeated')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed runs of each stage after a warm-up run (the fastest is kept)')
+    parser.add_argument('--synthetic', action='store_true', help='scale with generated rows instead of copies of the datasets')
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSON lines file where the results are appended')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='JSON file with the reference timings')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results of this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown over the baseline (0.25 = 25%%)')
+    parser.add_argument('--floor', type=float, default=ABSOLUTE_FLOOR, help='slowdowns under this many seconds are never regressions')
+    parser.add_argument('--normalize', action='store_true', help='scale the baseline by the speed of the machine measured with the calibration workload')
+    args = parser.parse_args(argv)
+
+    # A baseline of the other mode (synthetic data or repeated copies) is not comparable
+    baseline, baseline_synthetic = read_baseline(args.baseline)
+    if baseline and baseline_synthetic != args.synthetic:
+        saved = {None: 'without its mode', True: 'from synthetic data', False: 'from repeated copies'}[baseline_synthetic]
+        if not args.save_baseline:
+            current = 'synthetic data' if args.synthetic else 'repeated copies'
+            parser.error(f'the baseline {args.baseline} was saved {saved} and this run uses {current}: '
+                         'compare with a baseline of the same mode or save one with --save-baseline')
+        print(f'The baseline {args.baseline} was saved {saved}: it is replaced without comparing')
+        baseline = {}
+
+    run = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'synthetic': args.synthetic,
+           'python': platform.python_version(), 'pandas': pd.__version__, 'machine': platform.machine()}
+
+    # The calibration workload runs before, between and after the scales, and its
+    # fastest time is kept as the speed of the machine during the run
+    calibrations = [measure(calibration_workload, args.repeat)[0]]
+    results = measure_startup(args.repeat)
+    folder = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        for scale in args.scales:
+            results += run_scale(scale, args.repeat, folder, args.synthetic)
+            calibrations.append(measure(calibration_workload, args.repeat)[0])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    calibration = {**CALIBRATION, 'seconds': min(calibrations)}
+
+    # Compare with the baseline
+
+    # With --normalize the baseline is scaled by how much slower the machine runs
+    # the calibration workload, which is not part of the code under test
+    drift = machine_drift(calibration, baseline)
+    if args.normalize and drift is None:
+        print('The baseline has no calibration timing: the raw timings are compared')
+    scaling = drift if args.normalize and drift is not None else 1.0
+    run.update({'drift': drift, 'normalized': scaling != 1.0})
+
+    regressions = 0
+    print(f"{'stage':<60}{'rows':>10}{'seconds':>12}{'baseline':>12}")
+    for result in results:
+        key = result_key(result)
+        reference = baseline.get(key)
+        result['regression'] = (reference is not None and result['seconds'] > reference * scaling * (1 + args.tolerance)
+                                and result['seconds'] - reference * scaling > args.floor)
+        regressions += result['regression']
+        reference_text = f'{reference:.4f}' if reference is not None else '-'
+        flag = '  REGRESSION' if result['regression'] else ''
+        print(f"{key:<60}{result['rows']:>10}{result['seconds']:>12.4f}{reference_text:>12}{flag}")
+    drift_text = f'{drift:.2f}x the baseline' if drift is not None else 'no baseline'
+    print(f"Calibration workload: {calibration['seconds']:.4f} s ({drift_text}{', applied' if scaling != 1.0 else ''})")
+    results.append(calibration)
+
+    # Append the run to the history
+    os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+    with open(args.history, 'a') as f:
+        for result in results:
+            f.write(json.dumps({**run, **result}) + '\n')
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({'synthetic': args.synthetic, 'timings': {result_key(result): result['seconds'] for result in results}},
+                      f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+
+    print(f'{regressions} regressions over {len(results)} stages')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+from functions_cache import load_product, load_marketing, load_click_cube
+from functions_render import SAVEFIG_OPTIONS
+from functions_report import DEFAULT_PRESET, load_presets, chart_plan
+
+
+# Folder where the reports are written and image formats supported by the export
+EXPORT_DIR = 'reports'
+FORMATS = ['png', 'svg', 'pdf']
+
+
+def export_chart(func, args, paths):
+    """
+    Draws a chart and saves it to every path (the format is taken from the
+    extension). Runs in a worker process. Returns the paths and the seconds spent.
+    """
+    start = time.perf_counter()
+    fig = func(*args)
+    for path in paths:
+        fig.savefig(path, **{**SAVEFIG_OPTIONS, 'format': os.path.splitext(path)[1].lstrip('.')})
+    return paths, time.perf_counter() - start
+
+
+def export_reports(presets, formats=('png',), folder=EXPORT_DIR, workers=None):
+    """
+    Loads and cleans the three datasets once and writes every chart of the
+    app for each preset to folder/<preset>/<chart>.<format>. The charts are
+    drawn in parallel by a process pool.
+
+    Returns a list of (preset, chart, seconds) in the order of the plan.
+    """
+    # Load data (cleaned tables are cached on disk, see functions_cache)
+    product_store = load_product()
+    df_marketing = load_marketing()
+    click_cube = load_click_cube()
+
+    tasks = []
+    for name, preset in presets.items():
+        os.makedirs(os.path.join(folder, name), exist_ok=True)
+        for study, chart, func, args in chart_plan(product_store, df_marketing, click_cube, preset):
+            paths = [os.path.join(folder, name, f'{chart}.{file_format}') for file_format in formats]
+            tasks.append((name, chart, func, args, paths))
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(export_chart, func, args, paths) for _, _, func, args, paths in tasks]
+        return [(name, chart, future.result()[1]) for (name, chart, _, _, _), future in zip(tasks, futures)]
+
+
+def main(argv=None):
+    """
+    Command line entry point, e.g. python export.py --config report_presets.json --formats png pdf
+    """
+    parser = argparse.ArgumentParser(description='Export every chart of the studies without running the app.')
+    parser.add_argument('--config', help='JSON file with the filter presets (the defaults of the app if omitted)')
+    parser.add_argument('--presets', nargs='+', help='presets of the config to export (all by default)')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['png'], help='image formats to write')
+    parser.add_argument('--output', default=EXPORT_DIR, help='folder where the charts are written')
+    parser.add_argument('--workers', type=int, default=None, help='processes used to draw the charts')
+    args = parser.parse_args(argv)
+
+    presets = load_presets(args.config) if args.config else {'default': dict(DEFAULT_PRESET)}
+    if args.presets:
+        missing = set(args.presets) - set(presets)
+        if missing:
+            parser.error(f'unknown presets {sorted(missing)}')
+        presets = {name: presets[name] for name in args.presets}
+
+    start = time.perf_counter()
+    results = export_reports(presets, args.formats, args.output, args.workers)
+    wall = time.perf_counter() - start
+
+    print(f"{'chart':<50}{'seconds':>10}")
+    for name, chart, seconds in results:
+        print(f'{name + "/" + chart:<50}{seconds:>10.3f}')
+    print(f'{len(results)} charts in {len(presets)} presets written to {args.output} in {wall:.2f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
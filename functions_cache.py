@@ -0,0 +1,257 @@
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functions_snapshot import file_hash
+from functions_profile import timed, current_timings, recording_to
+from functions_shared import shareable, publish, attach
+from functions_index import INDEX_VERSION, build_range_index
+from functions_product import PRODUCT_PATH, CLEAN_VERSION as PRODUCT_VERSION, read_df_product, clean_df_product
+from functions_marketing import MARKETING_PATH, CLEAN_VERSION as MARKETING_VERSION, MARKETING_INDEX_COLUMNS, read_df_marketing, clean_df_marketing
+from functions_click import CLICK_PATH, CLICK_APPEND_PATH, CLEAN_VERSION as CLICK_VERSION, CUBE_VERSION, STREAM_MIN_BYTES, read_df_click, clean_df_click, build_click_cube, stream_click_cube, read_click_cube, merge_click_cubes
+
+
+# Folder where the cleaned DataFrames are stored and maximum size it can grow to
+CACHE_DIR = 'datasets/.cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Last value loaded for each cache name and hit/miss counters
+_memory = {}
+_stats = {'memory_hits': 0, 'shared_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+# Threads loading the datasets in the background and loads still running (see load_async)
+LOAD_WORKERS = 3
+_executor = None
+_loading = {}
+_loading_lock = threading.Lock()
+
+
+def cached(name, path, build, version):
+    """
+    Returns the result of build(), stored on disk under a key made of the name,
+    the content hash of the source file at path and the version of the cleaner.
+
+    The lookup goes through four levels:
+
+    1. The value already loaded by this process for the same key.
+    2. The DataFrames published in the shared store by any process of the
+       machine (see functions_shared), attached without copying them.
+    3. The pickle stored in CACHE_DIR by a previous run (or a previous server).
+    4. Calling build() and storing its result in CACHE_DIR.
+
+    DataFrames loaded from 3 or 4 are published in the shared store and
+    attached from it, so every server process uses the same copy in memory.
+    Changing the source file or bumping the version changes the key, so stale
+    values are never returned. Old entries are evicted by evict_cache().
+    """
+    key = f'{name}-{file_hash(path)[:16]}-v{version}'
+
+    # Value already loaded by this process
+    if name in _memory and _memory[name][0] == key:
+        _stats['memory_hits'] += 1
+        return _memory[name][1]
+
+    # Value published by another process
+    with timed('load', f'{name} (shared store)'):
+        value = attach(key)
+    if value is not None:
+        _stats['shared_hits'] += 1
+        _memory[name] = (key, value)
+        return value
+
+    cache_file = os.path.join(CACHE_DIR, key + '.pkl')
+    try:
+        with timed('load', f'{name} (disk cache)'), open(cache_file, 'rb') as f:
+            value = pickle.load(f)
+        # Refresh the modification time so the eviction keeps recently used entries
+        os.utime(cache_file)
+        _stats['disk_hits'] += 1
+    except Exception:
+        # Missing or unreadable entry (e.g. written by another pandas version): build it again
+        value = build()
+        _stats['misses'] += 1
+
+        # Write to a temporary file first so other processes never read a partial pickle
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        evict_cache()
+
+    # Share the DataFrames with the other processes and use the shared copy here too
+    if shareable(value):
+        try:
+            publish(key, value)
+            shared_value = attach(key)
+            if shared_value is not None:
+                value = shared_value
+        except OSError:
+            # The shared store is full or not writable: keep the private copy
+            pass
+
+    _memory[name] = (key, value)
+    return value
+
+
+def load_async(loader):
+    """
+    Starts loader() (e.g. load_product) in a background thread and returns
+    its future, so several datasets are read and cleaned at the same time and
+    each one is waited for only where it is used.
+
+    While a loader is running, the same future is returned to every caller
+    (looked up by the name of the loader), so sessions opening at the same
+    time do not load a dataset twice. Once it is done, the next call starts
+    it again, which is a memory hit of cached() if the source has not changed.
+
+    The timed stages of the loader are recorded to the timings of the rerun
+    that started it, if it is being profiled (see recording_to).
+    """
+    global _executor
+    with _loading_lock:
+        future = _loading.get(loader.__name__)
+        if future is None or future.done():
+            if _executor is None:
+                _executor = ThreadPoolExecutor(LOAD_WORKERS, thread_name_prefix='load')
+            future = _loading[loader.__name__] = _executor.submit(_load_recorded, loader, current_timings())
+    return future
+
+
+def _load_recorded(loader, timings):
+    """
+    Runs loader() in a loading thread, recording its timed stages to timings.
+    """
+    with recording_to(timings):
+        return loader()
+
+
+def evict_cache(max_bytes=CACHE_MAX_BYTES):
+    """
+    Deletes the least recently used entries of CACHE_DIR until its total size is under max_bytes.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    # Collect the entries sorted from the least to the most recently used
+    entries = []
+    for file_name in os.listdir(CACHE_DIR):
+        if file_name.endswith('.pkl'):
+            stat = os.stat(os.path.join(CACHE_DIR, file_name))
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_name in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, file_name))
+        except FileNotFoundError:
+            # Already evicted by another process
+            pass
+        total -= size
+
+
+def cache_stats():
+    """
+    Returns the hit/miss counters of this process together with the number
+    of entries and the size in bytes of CACHE_DIR.
+    """
+    stats = dict(_stats)
+    stats['hits'] = stats['memory_hits'] + stats['shared_hits'] + stats['disk_hits']
+    stats['entries'] = 0
+    stats['bytes'] = 0
+    if os.path.isdir(CACHE_DIR):
+        for file_name in os.listdir(CACHE_DIR):
+            if file_name.endswith('.pkl'):
+                stats['entries'] += 1
+                stats['bytes'] += os.path.getsize(os.path.join(CACHE_DIR, file_name))
+    return stats
+
+
+def _read_and_clean(read, clean):
+    """
+    Returns clean(read()), timing both stages for the profiling panel.
+    """
+    with timed('read', read.__name__):
+        df = read()
+    with timed('clean', clean.__name__):
+        return clean(df)
+
+
+def load_product():
+    """
+    Returns the store of the wine consume study (see clean_df_product). The
+    tables of the charts are taken from it with product_table.
+    """
+    return cached('product', PRODUCT_PATH, lambda: _read_and_clean(read_df_product, clean_df_product), PRODUCT_VERSION)
+
+
+def load_marketing():
+    """
+    Returns the cleaned DataFrame of the marketing study.
+    """
+    return cached('marketing', MARKETING_PATH, lambda: _read_and_clean(read_df_marketing, clean_df_marketing), MARKETING_VERSION)
+
+
+def load_marketing_index():
+    """
+    Returns the sorted range index of the cleaned marketing DataFrame (see build_range_index).
+    """
+    def build():
+        df_marketing = load_marketing()
+        with timed('aggregate', 'build_range_index'):
+            return build_range_index(df_marketing, MARKETING_INDEX_COLUMNS)
+    return cached('marketing_index', MARKETING_PATH, build, f'{MARKETING_VERSION}.{INDEX_VERSION}')
+
+
+def load_click():
+    """
+    Returns the cleaned DataFrame of the click study.
+    """
+    return cached('click', CLICK_PATH, lambda: _read_and_clean(read_df_click, clean_df_click), CLICK_VERSION)
+
+
+def load_appended_clicks():
+    """
+    Returns the count cube of the click batches appended with append_clicks(),
+    or None if there is none. It is read again only when the file changes.
+    """
+    if not os.path.exists(CLICK_APPEND_PATH):
+        return None
+    stat = os.stat(CLICK_APPEND_PATH)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if 'click_appended' not in _memory or _memory['click_appended'][0] != key:
+        with timed('load', 'click_appended'):
+            _memory['click_appended'] = (key, read_click_cube(CLICK_APPEND_PATH))
+    return _memory['click_appended'][1]
+
+
+def load_click_cube():
+    """
+    Returns the count cube of the click study (see build_click_cube), with
+    the counts of the appended click batches (see append_clicks).
+    Click logs of STREAM_MIN_BYTES or more are streamed in chunks instead
+    of being loaded as a whole DataFrame.
+    """
+    if os.path.getsize(CLICK_PATH) >= STREAM_MIN_BYTES:
+        def build():
+            with timed('read', 'stream_click_cube'):
+                return stream_click_cube(CLICK_PATH)
+    else:
+        def build():
+            df_click = load_click()
+            with timed('aggregate', 'build_click_cube'):
+                return build_click_cube(df_click)
+    cube = cached('click_cube', CLICK_PATH, build, f'{CLICK_VERSION}.{CUBE_VERSION}')
+
+    # Add the appended batches, once for every version of them
+    appended = load_appended_clicks()
+    if appended is None:
+        return cube
+    merged = _memory.get('click_cube_appended')
+    if merged is None or merged[0] is not cube or merged[1] is not appended:
+        with timed('aggregate', 'merge_click_cubes'):
+            merged = _memory['click_cube_appended'] = (cube, appended, merge_click_cubes(cube, appended))
+    return merged[2]
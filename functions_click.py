@@ -1,72 +1,319 @@
+import os
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
-
-
-def read_df_click():
+from functions_snapshot import read_snapshot
+from functions_schema import apply_schema
+from functions_render import new_figure
+
+
+# Path of the ad click dataset and version of clean_df_click
+CLICK_PATH = 'datasets/adsclicking.csv'
+CLEAN_VERSION = 2
+
+# Columns of the dataset used by the click study
+CLICK_COLUMNS = ['Age', 'Gender', 'Income', 'Interest_Category', 'Click']
+
+# Bins and labels of the income and age ranges
+INCOME_BINS = [20000, 40000, 60000, 80000, 100000]
+INCOME_LABELS = ['20k-40k', '40k-60k', '60k-80k', '80k-100k']
+AGE_BINS = [16, 24, 34, 44, 54, 90]
+AGE_LABELS = ['16-24', '25-34', '35-44', '45-54', '55+']
+
+# Columns and types of the cleaned DataFrame (see apply_schema)
+CLICK_SCHEMA = {
+    'Age': 'integer',
+    'Gender': 'category',
+    'Income': 'integer',
+    'Interest_Category': 'category',
+    'Click': 'integer',
+    'Income_Range': pd.CategoricalDtype(INCOME_LABELS, ordered=True),
+    'Age_Range': pd.CategoricalDtype(AGE_LABELS, ordered=True),
+}
+
+# Values the income and age sliders can take, which are the edges of the count cube
+# (every bin edge must be one of them so each cube cell falls in a single range)
+CUBE_INCOME_EDGES = np.arange(INCOME_BINS[0], INCOME_BINS[-1] + 1, 1000)
+CUBE_AGE_EDGES = np.arange(AGE_BINS[0], AGE_BINS[-1] + 1, 1)
+CUBE_VERSION = 1
+
+# Counts of the click batches appended after the dataset (see append_clicks)
+CLICK_APPEND_PATH = 'datasets/adsclicking_appended.npz'
+
+# Rows read at once when streaming a click log, and file size from which the app streams it
+STREAM_CHUNK_ROWS = 500000
+STREAM_MIN_BYTES = 256 * 1024 * 1024
+
+
+def read_df_click(url=CLICK_PATH):
     """
     Reads the adsclicking.csv dataset from the datasets folder into a pandas DataFrame.
+
+    Only the columns in CLICK_COLUMNS are read. The Arrow snapshot of the
+    dataset is used when it is up to date, otherwise the CSV is parsed.
     """
-    url = 'datasets/adsclicking.csv'
-    df_click = pd.read_csv(url).copy()
+    df_click = read_snapshot(url, CLICK_COLUMNS)
+    if df_click is None:
+        df_click = pd.read_csv(url, usecols=CLICK_COLUMNS)
     return df_click
 
 
 def clean_df_click(df):
     """
     Clean the adsclicking dataset by removing unnecessary columns and
-    creating two new columns: Income_Range and Age_Range.
+    creating two new columns: Income_Range and Age_Range. The columns are
+    stored with the compact types of CLICK_SCHEMA.
     """
-    # Drop unnecessary columns
-    df = df.drop(columns=['Unnamed: 0', 'Location', 'Device', 'Time_Spent_on_Site', 'Number_of_Pages_Viewed'])
+    # Drop unnecessary columns (if they were read)
+    df = df.drop(columns=['Unnamed: 0', 'Location', 'Device', 'Time_Spent_on_Site', 'Number_of_Pages_Viewed'], errors='ignore')
     
     # Create the Income_Range column
-    bins = [20000, 40000, 60000, 80000, 100000]
-    labels = ['20k-40k', '40k-60k', '60k-80k', '80k-100k']
-    df['Income_Range'] = pd.cut(df['Income'], bins=bins, labels=labels, include_lowest=True)
+    df['Income_Range'] = pd.cut(df['Income'], bins=INCOME_BINS, labels=INCOME_LABELS, include_lowest=True)
     
     # Create the Age_Range column
-    bins = [16, 24, 34, 44, 54, 90]
-    labels = ['16-24', '25-34', '35-44', '45-54', '55+']
-    df['Age_Range'] = pd.cut(df['Age'], bins=bins, labels=labels, include_lowest=True)
+    df['Age_Range'] = pd.cut(df['Age'], bins=AGE_BINS, labels=AGE_LABELS, include_lowest=True)
+
+    # Keep the columns of the schema with compact types
+    df = apply_schema(df, CLICK_SCHEMA)
 
     return df
 
 
+def _cube_cells(values, edges):
+    """
+    Returns the cube cell of each value: cell 2*i+1 holds the values equal to edges[i]
+    and cell 2*i the values between edges[i-1] and edges[i] (cell 0 is below the
+    first edge and cell 2*len(edges) above the last one).
+    """
+    values = np.asarray(values, dtype=float)
+    position = np.searchsorted(edges, values, side='left')
+    exact = edges[np.minimum(position, len(edges) - 1)] == values
+    return 2 * position + exact
+
+
+def _cube_slice(edges, value_range):
+    """
+    Returns the slice of cube cells with values strictly between the two
+    ends of value_range, which must be edges of the cube.
+    """
+    if value_range is None:
+        return slice(None)
+
+    low, high = np.searchsorted(edges, value_range)
+    if low >= len(edges) or high >= len(edges) or edges[low] != value_range[0] or edges[high] != value_range[1]:
+        raise ValueError(f'Range {value_range} is not on the grid of the count cube')
+    return slice(2 * low + 2, 2 * high + 1)
+
+
+def _cell_ranges(edges, bins, labels):
+    """
+    Returns the position in labels of the range of every cube cell (-1 outside the bins).
+    """
+    # A value representative of each cell: the edge itself or the middle of the gap
+    values = np.empty(2 * len(edges) + 1)
+    values[1::2] = edges
+    values[2:-1:2] = (edges[:-1] + edges[1:]) / 2
+    values[0] = edges[0] - 1
+    values[-1] = edges[-1] + 1
+    return pd.cut(values, bins=bins, labels=labels, include_lowest=True).codes
+
+
+def empty_click_cube():
+    """
+    Returns a count cube of the click study without any row (see build_click_cube).
+    """
+    return {
+        'counts': np.zeros((2 * len(CUBE_INCOME_EDGES) + 1, 2 * len(CUBE_AGE_EDGES) + 1, 0, 2), dtype=np.int64),
+        'categories': [],
+        'income_ranges': _cell_ranges(CUBE_INCOME_EDGES, INCOME_BINS, INCOME_LABELS),
+        'age_ranges': _cell_ranges(CUBE_AGE_EDGES, AGE_BINS, AGE_LABELS),
+    }
+
+
+def add_to_click_cube(cube, df):
+    """
+    Adds the rows of a DataFrame with the Income, Age, Interest_Category and
+    Click columns to a count cube, in place. Interest categories not seen
+    before are appended to the cube. Returns the cube.
+    """
+    # Grow the category axis with the new categories
+    new_categories = sorted(set(df['Interest_Category'].dropna().unique()) - set(cube['categories']))
+    if new_categories:
+        cube['categories'] = cube['categories'] + new_categories
+        cube['counts'] = np.pad(cube['counts'], ((0, 0), (0, 0), (0, len(new_categories)), (0, 0)))
+
+    # Encode every row as the flat position of its cube cell
+    income_cells = _cube_cells(df['Income'], CUBE_INCOME_EDGES)
+    age_cells = _cube_cells(df['Age'], CUBE_AGE_EDGES)
+    category_codes = pd.Categorical(df['Interest_Category'], categories=cube['categories']).codes
+    clicks = df['Click'].to_numpy()
+
+    shape = cube['counts'].shape
+    valid = category_codes >= 0
+    flat = np.ravel_multi_index((income_cells[valid], age_cells[valid], category_codes[valid], clicks[valid]), shape)
+    cube['counts'] += np.bincount(flat, minlength=np.prod(shape)).reshape(shape)
+    return cube
+
+
+def build_click_cube(df):
+    """
+    Builds the count cube of the click study: the number of rows of the cleaned
+    DataFrame for every (income cell, age cell, interest category, click) where
+    the cells are the slider values and the gaps between them (see _cube_cells).
+
+    Any combination of the income and age sliders can then be answered by
+    slice_click_cube() without scanning the rows again.
+    """
+    return add_to_click_cube(empty_click_cube(), df)
+
+
+def stream_click_cube(url=CLICK_PATH, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Builds the count cube of a click log reading the CSV in chunks of chunk_rows
+    rows (only the CLICK_COLUMNS), so the memory used does not depend on the
+    size of the file. The income and age ranges of each chunk are given by the
+    cube cells, and slice_click_cube() of the result returns the clicks and rows
+    per Income_Range, Age_Range and Interest_Category the charts need.
+    """
+    cube = empty_click_cube()
+    for chunk in pd.read_csv(url, usecols=CLICK_COLUMNS, chunksize=chunk_rows):
+        add_to_click_cube(cube, chunk)
+    return cube
+
+
+def merge_click_cubes(cube, other):
+    """
+    Returns a new count cube with the counts of both cubes. The interest
+    categories of other not in cube are appended to its categories.
+    """
+    merged = {**cube, 'counts': cube['counts'].copy()}
+    new_categories = [category for category in other['categories'] if category not in cube['categories']]
+    if new_categories:
+        merged['categories'] = cube['categories'] + new_categories
+        merged['counts'] = np.pad(merged['counts'], ((0, 0), (0, 0), (0, len(new_categories)), (0, 0)))
+
+    positions = [merged['categories'].index(category) for category in other['categories']]
+    merged['counts'][:, :, positions] += other['counts']
+    return merged
+
+
+def save_click_cube(cube, path):
+    """
+    Writes the counts and categories of a count cube to a .npz file. The file
+    is written to a temporary file first, so readers never see a partial cube.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, counts=cube['counts'], categories=np.asarray(cube['categories'], dtype=str), version=CUBE_VERSION)
+    os.replace(tmp_path, path)
+
+
+def read_click_cube(path):
+    """
+    Reads a count cube written by save_click_cube.
+    """
+    with np.load(path) as data:
+        if int(data['version']) != CUBE_VERSION:
+            raise ValueError(f'{path} holds a count cube of version {int(data["version"])}, expected {CUBE_VERSION}')
+        cube = empty_click_cube()
+        cube['counts'] = data['counts']
+        cube['categories'] = [str(category) for category in data['categories']]
+    return cube
+
+
+def append_clicks(df, path=CLICK_APPEND_PATH):
+    """
+    Appends a batch of click rows (a DataFrame with the CLICK_COLUMNS) to the
+    counts stored at path, which load_click_cube() adds to the counts of the
+    dataset. The batch is cleaned as clean_df_click does and only its counts
+    are stored, so the time of an append depends on the size of the batch and
+    not on the rows appended before it. Returns the cube of all the appended batches.
+
+    The counts are read, updated and written back, so batches must be
+    appended by a single process at a time. Once the batches are added to
+    CLICK_PATH itself, delete the file at path so they are not counted twice.
+    """
+    batch = clean_df_click(df[CLICK_COLUMNS].copy())
+    cube = read_click_cube(path) if os.path.exists(path) else empty_click_cube()
+    add_to_click_cube(cube, batch)
+    save_click_cube(cube, path)
+    return cube
+
+
+def slice_click_cube(cube, income_range=None, age_range=None):
+    """
+    Returns the counts frame of the rows with Income and Age strictly between the
+    given ranges (None keeps every value), i.e. the number of rows ('Count') of
+    every observed Income_Range, Age_Range, Interest_Category and Click.
+
+    The click chart functions accept this frame in place of the row-level DataFrame.
+    """
+    income_slice = _cube_slice(CUBE_INCOME_EDGES, income_range)
+    age_slice = _cube_slice(CUBE_AGE_EDGES, age_range)
+    counts = cube['counts'][income_slice, age_slice]
+
+    # Sum the cells of each range (cells outside the bins go to an extra last range)
+    income_onehot = np.eye(len(INCOME_LABELS) + 1, dtype=counts.dtype)[cube['income_ranges'][income_slice]]
+    age_onehot = np.eye(len(AGE_LABELS) + 1, dtype=counts.dtype)[cube['age_ranges'][age_slice]]
+    totals = np.einsum('ia,jb,ijkc->abkc', income_onehot, age_onehot, counts)
+
+    # Build the counts frame with the observed combinations only
+    income_codes, age_codes, category_codes, clicks = np.nonzero(totals)
+    income_codes[income_codes == len(INCOME_LABELS)] = -1
+    age_codes[age_codes == len(AGE_LABELS)] = -1
+    return pd.DataFrame({
+        'Income_Range': pd.Categorical.from_codes(income_codes, categories=INCOME_LABELS, ordered=True),
+        'Age_Range': pd.Categorical.from_codes(age_codes, categories=AGE_LABELS, ordered=True),
+        'Interest_Category': np.asarray(cube['categories'], dtype=object)[category_codes],
+        'Click': clicks,
+        'Count': totals[np.nonzero(totals)],
+    })
+
+
+def group_counts(df, keys):
+    """
+    Returns the number of rows of every group of keys. df is either the
+    row-level DataFrame or a counts frame from slice_click_cube().
+    """
+    grouped = df.groupby(keys, observed=False)
+    if 'Count' in df.columns:
+        return grouped['Count'].sum()
+    return grouped.size()
+
+
 def click_by_category(df, size):
     """
     Creates a bar plot of the percentage of ad clicks by category.
     """
     # Create a pivot table of the ad clicks by category and click status
-    df_pivot = df.pivot_table(index='Interest_Category', columns='Click', aggfunc='size', fill_value=0)
+    df_pivot = group_counts(df, ['Interest_Category', 'Click']).unstack(fill_value=0)
 
     # Calculate the percentage of ad clicks by category
     df_pivot_percentage = df_pivot.div(df_pivot.sum(axis=1), axis=0) * 100
 
     # Create a bar plot of the percentage of ad clicks by category
-    ax = df_pivot_percentage.plot(kind='bar', figsize=(8, 6), color=['#d9e6f2', '#4a90e2'])
+    fig = new_figure(figsize=(8, 6))
+    ax = fig.subplots()
+    df_pivot_percentage.plot(kind='bar', color=['#d9e6f2', '#4a90e2'], ax=ax)
 
     # Set the y-axis limits
     ax.set_ylim(size[0], size[1])
 
     # Set the x-axis label
-    plt.xlabel('Category')
+    ax.set_xlabel('Category')
 
     # Set the y-axis label
-    plt.ylabel('Percentage (%)')
+    ax.set_ylabel('Percentage (%)')
 
     # Rotate the x-axis labels
-    plt.xticks(rotation=0)
+    ax.tick_params(axis='x', labelrotation=0)
 
     # Set the legend
-    plt.legend(title='Click', labels=['No Click', 'Click'])
+    ax.legend(title='Click', labels=['No Click', 'Click'])
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def click_by_category_income(df):
@@ -75,7 +322,7 @@ def click_by_category_income(df):
     and income range.
     """
     # Create a pivot table of the ad clicks by category, income range, and click status
-    df_grouped = df.groupby(['Income_Range', 'Interest_Category', 'Click'], observed=False).size().unstack(fill_value=0)
+    df_grouped = group_counts(df, ['Income_Range', 'Interest_Category', 'Click']).unstack(fill_value=0).reindex(columns=[0, 1], fill_value=0)
 
     # Calculate the total number of clicks by category and income range
     df_grouped['Total'] = df_grouped[0] + df_grouped[1]
@@ -87,28 +334,29 @@ def click_by_category_income(df):
     df_pivot = df_grouped.reset_index().pivot(index='Income_Range', columns='Interest_Category', values='Percentage_Click')
 
     # Create a bar plot of the percentage of clicks by category and income range
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
-    ax = df_pivot.plot(kind='bar', stacked=False, colormap='tab10', width=0.8, ax=plt.gca())
+    df_pivot.plot(kind='bar', stacked=False, colormap='tab10', width=0.8, ax=ax)
     ax.set_ylim(39, 61)
 
     # Set the x-axis label
-    plt.xlabel('Income range')
+    ax.set_xlabel('Income range')
 
     # Set the y-axis label
-    plt.ylabel('Click (%)')
+    ax.set_ylabel('Click (%)')
 
     # Set the legend
-    plt.legend(title='Category')
+    ax.legend(title='Category')
 
     # Rotate the x-axis labels
-    plt.xticks(rotation=0)
+    ax.tick_params(axis='x', labelrotation=0)
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def click_by_category_age(df):
@@ -117,10 +365,11 @@ def click_by_category_age(df):
     and age range.
     """
     # Create a pivot table of the ad clicks by category and age range
-    df_grouped = df.groupby(['Age_Range', 'Interest_Category'], observed=False).agg({'Click': ['sum', 'count']})
+    df_grouped = group_counts(df, ['Age_Range', 'Interest_Category', 'Click']).unstack(fill_value=0).reindex(columns=[0, 1], fill_value=0)
 
-    # Rename the columns of the grouped DataFrame
-    df_grouped.columns = ['Total_Clicks', 'Total_Count']
+    # Count the clicks and the rows of each category and age range
+    df_grouped['Total_Clicks'] = df_grouped[1]
+    df_grouped['Total_Count'] = df_grouped[0] + df_grouped[1]
 
     # Calculate the percentage of clicks by category and age range
     df_grouped['Percentage_Click'] = df_grouped['Total_Clicks'] / df_grouped['Total_Count'] * 100
@@ -130,25 +379,26 @@ def click_by_category_age(df):
     df_pivot = df_pivot.pivot(index='Age_Range', columns='Interest_Category', values='Percentage_Click')
 
     # Create a bar plot of the percentage of clicks by category and age range
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
-    ax = df_pivot.plot(kind='bar', stacked=False, colormap='tab10', width=0.8, ax=plt.gca())
+    df_pivot.plot(kind='bar', stacked=False, colormap='tab10', width=0.8, ax=ax)
     ax.set_ylim([40, 60])
 
     # Set the x-axis label
-    plt.xlabel('Age range')
+    ax.set_xlabel('Age range')
 
     # Set the y-axis label
-    plt.ylabel('Click (%)')
+    ax.set_ylabel('Click (%)')
 
     # Set the legend
-    plt.legend(title='Category', loc=('upper left'))
+    ax.legend(title='Category', loc=('upper left'))
 
     # Rotate the x-axis labels
-    plt.xticks(rotation=0)
+    ax.tick_params(axis='x', labelrotation=0)
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
\ No newline at end of file
+    return fig
\ No newline at end of file
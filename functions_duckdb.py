@@ -0,0 +1,225 @@
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functions_snapshot import file_hash
+from functions_profile import timed
+from functions_cache import load_marketing, load_click
+from functions_marketing import MARKETING_PATH, CLEAN_VERSION as MARKETING_VERSION, AGGREGATE_KEYS, AGGREGATE_VALUES, COHORT_VALUES, aggregate_labels, marketing_groupings, daily_cohorts
+from functions_click import CLICK_PATH, CLEAN_VERSION as CLICK_VERSION, CLICK_COLUMNS, INCOME_LABELS, AGE_LABELS, STREAM_CHUNK_ROWS, STREAM_MIN_BYTES, clean_df_click
+
+
+# Query backend of the deployment: 'pandas' filters and groups the DataFrames in
+# memory, 'duckdb' runs the filters and groupings as SQL over Parquet tables
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+
+# Folder of the Parquet tables, and threads and memory DuckDB can use
+# (above the memory limit it spills to the temp folder instead of failing)
+TABLE_DIR = 'datasets/.tables'
+DUCKDB_THREADS = int(os.environ.get('DUCKDB_THREADS', os.cpu_count() or 1))
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT', '1GB')
+
+# Connection shared by the threads of the server (each query uses its own cursor)
+_connection = None
+_lock = threading.Lock()
+
+
+def connect():
+    """
+    Returns a cursor on the DuckDB database of this process, an in-memory
+    database reading the Parquet tables of TABLE_DIR. duckdb is only imported
+    here, so it is needed by the 'duckdb' backend only.
+    """
+    global _connection
+    with _lock:
+        if _connection is None:
+            import duckdb
+            _connection = duckdb.connect(config={
+                'threads': DUCKDB_THREADS,
+                'memory_limit': DUCKDB_MEMORY_LIMIT,
+                'temp_directory': os.path.join(TABLE_DIR, 'spill'),
+            })
+    return _connection.cursor()
+
+
+def _plain_table(df):
+    """
+    Converts a cleaned DataFrame to an Arrow table with plain column types:
+    categories as strings, integers as int64 and floats as float64. Every
+    chunk of a table then has the same schema whatever its values.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return table.cast(pa.schema(fields))
+
+
+def write_table(frames, file):
+    """
+    Writes an iterable of cleaned DataFrames to a single Parquet file, one row
+    group per DataFrame. Only one DataFrame is in memory at a time.
+    """
+    tmp_file = f'{file}.{os.getpid()}.tmp'
+    writer = None
+    try:
+        for df in frames:
+            table = _plain_table(df)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_file, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_file, file)
+
+
+def parquet_table(name, path, frames, version):
+    """
+    Returns the path of the Parquet table of a dataset, written from frames()
+    the first time, under a key made of the name, the content hash of the
+    source file at path and the version of its cleaner (as in cached()).
+    The tables of older keys with the same name are removed.
+    """
+    key = f'{name}-{file_hash(path)[:16]}-v{version}'
+    file = os.path.join(TABLE_DIR, key + '.parquet')
+    if os.path.exists(file):
+        return file
+
+    os.makedirs(TABLE_DIR, exist_ok=True)
+    with timed('read', f'{name} (parquet)'):
+        write_table(frames(), file)
+    for file_name in os.listdir(TABLE_DIR):
+        if file_name.startswith(name + '-') and file_name != key + '.parquet':
+            try:
+                os.remove(os.path.join(TABLE_DIR, file_name))
+            except FileNotFoundError:
+                # Already removed by another process
+                pass
+    return file
+
+
+def marketing_table():
+    """
+    Returns the path of the Parquet table of the cleaned marketing study.
+    """
+    return parquet_table('marketing', MARKETING_PATH, lambda: [load_marketing()], MARKETING_VERSION)
+
+
+def click_table():
+    """
+    Returns the path of the Parquet table of the cleaned click study. Click logs
+    of STREAM_MIN_BYTES or more are cleaned and written in chunks, so the table
+    can be larger than the memory of the server.
+    """
+    if os.path.getsize(CLICK_PATH) >= STREAM_MIN_BYTES:
+        def frames():
+            for chunk in pd.read_csv(CLICK_PATH, usecols=CLICK_COLUMNS, chunksize=STREAM_CHUNK_ROWS):
+                yield clean_df_click(chunk)
+    else:
+        def frames():
+            return [load_click()]
+    return parquet_table('click', CLICK_PATH, frames, CLICK_VERSION)
+
+
+def _where(ranges):
+    """
+    Returns the WHERE clause keeping the rows with every column of ranges
+    strictly inside its (low, high) range, and its parameters. None ranges
+    are ignored, as in filter_ranges().
+    """
+    conditions = []
+    parameters = []
+    for column, value_range in ranges.items():
+        if value_range is not None:
+            conditions.append(f'"{column}" > ? AND "{column}" < ?')
+            parameters.extend(float(value) for value in value_range)
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters
+
+
+def column_bounds(table, column):
+    """
+    Returns the minimum and maximum of a column of a Parquet table (read from its statistics when possible).
+    """
+    return list(connect().execute(f'SELECT min("{column}"), max("{column}") FROM read_parquet(?)', [table]).fetchone())
+
+
+def select_rows(table, columns, ranges):
+    """
+    Returns the given columns of the rows of a Parquet table inside ranges
+    (see _where), in the order of the table. Only those columns are read.
+    """
+    where, parameters = _where(ranges)
+    select = ', '.join(f'"{column}"' for column in columns)
+    return connect().execute(f'SELECT {select} FROM read_parquet(?){where}', [table] + parameters).df()
+
+
+def marketing_aggregates(table, wine_range=None):
+    """
+    Returns the groupings of the marketing charts (see aggregate_marketing) for
+    the customers with MntWines strictly inside wine_range.
+
+    A single query with one grouping set per key of AGGREGATE_KEYS, and one
+    for the day of enrollment, returns the number of customers and the sums
+    of AGGREGATE_VALUES of every label and day, so only the rows of the charts
+    and of the daily cohort series leave DuckDB. The means are taken from
+    those exact sums, as aggregate_marketing does.
+    """
+    where, parameters = _where({'MntWines': wine_range})
+    keys = [f'"{key}"' for key in AGGREGATE_KEYS] + ['CAST("Dt_Customer" AS DATE)']
+    names = AGGREGATE_KEYS + ['Day']
+    columns = ', '.join(f'{key} AS "{name}"' for key, name in zip(keys, names))
+    flags = ', '.join(f'grouping({key}) AS "{name}:total"' for key, name in zip(keys, names))
+    sums = ', '.join(f'sum("{value}")::DOUBLE AS "{value}"' for value in AGGREGATE_VALUES)
+    sets = ', '.join(f'({key})' for key in keys)
+    result = connect().execute(f'SELECT {columns}, {flags}, count(*) AS n, {sums} FROM read_parquet(?){where} '
+                               f'GROUP BY GROUPING SETS ({sets})', [table] + parameters).df()
+
+    # Totals of every label of each key (the missing values of the key are left out)
+    totals = {}
+    for key in AGGREGATE_KEYS:
+        rows = result[(result[f'{key}:total'] == 0) & result[key].notna()].set_index(key)
+        labels = aggregate_labels(key)
+        if not isinstance(labels[0], str):
+            rows.index = rows.index.astype('int64')
+        rows = rows[['n'] + AGGREGATE_VALUES].reindex(labels, fill_value=0)
+        totals[key] = (rows['n'].to_numpy(dtype='int64'), {value: rows[value].to_numpy(dtype='float64') for value in AGGREGATE_VALUES})
+    groupings = marketing_groupings(totals)
+
+    # Daily cohort series of the customers (see cohort_series)
+    rows = result[(result['Day:total'] == 0) & result['Day'].notna()].sort_values('Day')
+    groupings['cohort_daily'] = daily_cohorts(rows['Day'], rows['n'], {value: rows[value] for value in COHORT_VALUES})
+    return groupings
+
+
+def click_counts(table, income_range=None, age_range=None):
+    """
+    Returns the counts frame of the click rows with Income and Age strictly
+    inside the given ranges (None keeps every value): the number of rows
+    ('Count') of every observed Income_Range, Age_Range, Interest_Category and
+    Click, as slice_click_cube() returns it from the count cube.
+    """
+    where, parameters = _where({'Income': income_range, 'Age': age_range})
+
+    # The rows without an interest category are not in the cube either
+    where = f'{where} AND' if where else ' WHERE'
+    result = connect().execute(
+        'SELECT Income_Range, Age_Range, Interest_Category, Click, count(*) AS Count '
+        f'FROM read_parquet(?){where} Interest_Category IS NOT NULL GROUP BY ALL', [table] + parameters).df()
+
+    # Same types and order of the rows as the frame of the cube
+    counts = pd.DataFrame({
+        'Income_Range': pd.Categorical(result['Income_Range'], categories=INCOME_LABELS, ordered=True),
+        'Age_Range': pd.Categorical(result['Age_Range'], categories=AGE_LABELS, ordered=True),
+        'Interest_Category': result['Interest_Category'].to_numpy(dtype=object),
+        'Click': result['Click'].to_numpy(dtype='int64'),
+        'Count': result['Count'].to_numpy(dtype='int64'),
+    })
+    return counts.sort_values(['Income_Range', 'Age_Range', 'Interest_Category', 'Click']).reset_index(drop=True)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+# Version of the layout returned by build_range_index, part of its cache key
+INDEX_VERSION = 2
+
+
+def build_range_index(df, columns):
+    """
+    Builds a sorted index of the numeric columns of df, so the rows with a
+    value inside a range can be found with a binary search instead of a mask
+    over the whole column.
+
+    Returns a DataFrame with two columns for every column of df: '<column>:values',
+    the values in ascending order (missing values last), and '<column>:order',
+    the row positions in that order. Being a DataFrame, it can be kept in the
+    shared store like the data it indexes.
+    """
+    index = {}
+    for column in columns:
+        values = df[column].to_numpy(dtype='float64', na_value=np.nan)
+        order = np.argsort(values, kind='stable')
+        index[f'{column}:values'] = values[order]
+        index[f'{column}:order'] = order
+    return pd.DataFrame(index)
+
+
+def range_positions(index, column, value_range):
+    """
+    Returns the row positions (in sorted order of the column) with a value
+    strictly inside value_range, as the sliders of the app filter. The result
+    is a view on the index found with two binary searches.
+    """
+    values = index[f'{column}:values'].to_numpy()
+    order = index[f'{column}:order'].to_numpy()
+    start = np.searchsorted(values, value_range[0], side='right')
+    stop = np.searchsorted(values, value_range[1], side='left')
+    return order[start:max(start, stop)]
+
+
+def filter_ranges(df, index, ranges):
+    """
+    Returns the rows of df with every column of ranges strictly inside its
+    (low, high) range, in their original order. None ranges are ignored.
+
+    Every range is looked up with a binary search, the narrowest one gives
+    the candidate rows, and only those are checked against the other ranges,
+    so the cost depends on the rows selected instead of the size of df.
+    """
+    ranges = {column: value_range for column, value_range in ranges.items() if value_range is not None}
+    if not ranges:
+        return df
+
+    candidates = {column: range_positions(index, column, value_range) for column, value_range in ranges.items()}
+    narrowest = min(candidates, key=lambda column: len(candidates[column]))
+    positions = np.sort(candidates[narrowest])
+
+    # Check the candidates against the other ranges
+    for column, (low, high) in ranges.items():
+        if column != narrowest and len(positions):
+            values = df[column].to_numpy()[positions]
+            positions = positions[(values > low) & (values < high)]
+    return df.iloc[positions]
@@ -1,15 +1,71 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
-
-
-def read_df_marketing():
+from functions_snapshot import read_snapshot
+from functions_schema import apply_schema
+from functions_render import new_figure
+
+
+# Path of the marketing campaign dataset and version of clean_df_marketing
+MARKETING_PATH = 'datasets/marketing_campaign.xlsx'
+CLEAN_VERSION = 3
+
+# Columns of the dataset used by the marketing study
+MARKETING_COLUMNS = ['ID', 'Year_Birth', 'Education', 'Marital_Status', 'Income', 'Kidhome', 'Teenhome', 'Dt_Customer', 'MntWines',
+                     'NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases', 'NumWebVisitsMonth']
+
+# Columns and types of the cleaned DataFrame (see apply_schema)
+MARKETING_SCHEMA = {
+    'Income': 'float',
+    'Dt_Customer': 'datetime64[ns]',
+    'MntWines': 'integer',
+    'NumDealsPurchases': 'integer',
+    'NumWebPurchases': 'integer',
+    'NumCatalogPurchases': 'integer',
+    'NumStorePurchases': 'integer',
+    'NumWebVisitsMonth': 'integer',
+    'Education_Level': pd.CategoricalDtype(['High', 'Low', 'Middle']),
+    'Living_Status': pd.CategoricalDtype(['Living Alone', 'Living with Others']),
+    'Age': 'integer',
+    'Is_Parent': 'integer',
+    'Age_Range': pd.CategoricalDtype(['16-24', '25-34', '35-44', '45-54', '55-64', '65-74'], ordered=True),
+    'Income_Range': pd.CategoricalDtype(['20k-40k', '40k-60k', '60k-80k', '80k-100k'], ordered=True),
+}
+
+# Group keys and values of the marketing charts, all aggregated in one pass by aggregate_marketing
+AGGREGATE_KEYS = ['Age_Range', 'Income_Range', 'Education_Level', 'Living_Status', 'Is_Parent']
+AGGREGATE_VALUES = ['NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases', 'NumWebVisitsMonth', 'MntWines']
+PURCHASE_COLUMNS = ['NumDealsPurchases', 'NumWebPurchases', 'NumCatalogPurchases', 'NumStorePurchases']
+
+# Values summed by day of enrollment (see cohort_series), days of the rolling
+# window and views of the chart of purchases by enrollment date (see cohort_view)
+COHORT_VALUES = ['MntWines'] + PURCHASE_COLUMNS
+COHORT_WINDOW = 30
+COHORT_VIEWS = ['Month of year', 'Calendar month', 'Quarter', f'Rolling {COHORT_WINDOW} days']
+
+# Numeric columns filtered by range in the app (see functions_index)
+MARKETING_INDEX_COLUMNS = ['MntWines', 'Income', 'Age']
+
+# From this number of customers the income/wine charts draw a density grid of
+# (income, wine) bins instead of one marker per customer
+DENSITY_MIN_ROWS = 50000
+DENSITY_BINS = (160, 100)
+
+# Two-sided 95% quantiles of Student's t for 1 to 30 degrees of freedom
+T_975 = (12.7062, 4.3027, 3.1824, 2.7764, 2.5706, 2.4469, 2.3646, 2.3060, 2.2622, 2.2281,
+         2.2010, 2.1788, 2.1604, 2.1448, 2.1314, 2.1199, 2.1098, 2.1009, 2.0930, 2.0860,
+         2.0796, 2.0739, 2.0687, 2.0639, 2.0595, 2.0555, 2.0518, 2.0484, 2.0452, 2.0423)
+
+
+def read_df_marketing(url=MARKETING_PATH):
     """
     Reads the marketing_campaign.xlsx dataset from the datasets folder into a pandas DataFrame.
+
+    Only the columns in MARKETING_COLUMNS are read. The Arrow snapshot of the
+    dataset is used when it is up to date, otherwise the Excel file is parsed.
     """
-    url = 'datasets/marketing_campaign.xlsx'
-    df_marketing = pd.read_excel(url)
+    df_marketing = read_snapshot(url, MARKETING_COLUMNS)
+    if df_marketing is None:
+        df_marketing = pd.read_excel(url, usecols=MARKETING_COLUMNS)
     return df_marketing
 
 
@@ -25,7 +81,8 @@ def clean_df_marketing(df):
     6. Creates a new column 'Is_Parent' by setting it to 1 if the customer has kids or teenagers at home, otherwise 0.
     7. Creates a new column 'Age_Range' by binning the age of the customer into ranges of 16-24, 25-34, 35-44, 45-54, 55-64, 65-74.
     8. Creates a new column 'Income_Range' by binning the income of the customer into ranges of 20k-40k, 40k-60k, 60k-80k, 80k-100k.
-    9. Drops unnecessary columns.
+    9. Keeps the columns of MARKETING_SCHEMA with compact types: categories for the labels
+        and the smallest integer/float widths for the numbers.
 
     Returns a cleaned DataFrame
     """
@@ -69,26 +126,181 @@ def clean_df_marketing(df):
     labels = ['20k-40k', '40k-60k', '60k-80k', '80k-100k']
     df['Income_Range'] = pd.cut(df['Income'], bins=bins, labels=labels, right=False)
 
-    # Drop unnecessary columns
-    to_drop = ['Z_CostContact', 'Year_Birth', 'ID', 'Marital_Status', 'Education','Kidhome', 'Teenhome', 'Recency', 'MntFruits','MntMeatProducts',
-            'MntFishProducts', 'MntSweetProducts','MntGoldProds', 'AcceptedCmp3', 'AcceptedCmp4', 'AcceptedCmp5', 'AcceptedCmp1','AcceptedCmp2', 
-            'Complain', 'Z_CostContact', 'Z_Revenue', 'Response']
-    df = df.drop(to_drop, axis=1)
+    # Keep the columns of the schema with compact types
+    df = apply_schema(df, MARKETING_SCHEMA)
 
     return df
 
 
+def _group_codes(series):
+    """
+    Returns the labels of a group key and the code of every row: the position
+    of its label, or len(labels) for a missing or unknown value.
+    """
+    labels = aggregate_labels(series.name)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy().astype('int64')
+    else:
+        codes = series.to_numpy().astype('int64') - labels[0]
+    codes[(codes < 0) | (codes >= len(labels))] = len(labels)
+    return labels, codes
+
+
+def aggregate_marketing(df):
+    """
+    Computes the groupings of every marketing chart in two passes over df.
+
+    Every row gets one code combining its AGGREGATE_KEYS, and one np.bincount
+    per value gives the counts and sums of all the combinations at once. Each
+    grouping is then a sum over the other keys of that small array, so the
+    cost over the rows does not depend on the number of charts. The daily
+    cohort series is a second, separate scan of df (see cohort_series).
+
+    Returns a dict of DataFrames with the same content as the groupby of each chart:
+
+    - 'purchases_by_age' and 'purchases_by_income': mean of PURCHASE_COLUMNS by Age_Range / Income_Range (every range).
+    - 'visits_by_age': mean of NumWebVisitsMonth by Age_Range (every range).
+    - 'wine_by_education', 'wine_by_parent' and 'wine_by_living_status': mean of MntWines by
+      Education_Level / Is_Parent / Living_Status (observed groups only).
+    - 'cohort_daily': the customers and the sums of COHORT_VALUES by day of enrollment (see cohort_series).
+    """
+    # Combined group code of every row
+    labels, codes = zip(*[_group_codes(df[key]) for key in AGGREGATE_KEYS])
+    shape = tuple(len(key_labels) + 1 for key_labels in labels)
+    cells = np.ravel_multi_index(codes, shape)
+
+    # Counts and sums of every combination of the keys
+    size = int(np.prod(shape))
+    counts = np.bincount(cells, minlength=size).reshape(shape)
+    sums = {value: np.bincount(cells, weights=df[value].to_numpy(dtype='float64'), minlength=size).reshape(shape)
+            for value in AGGREGATE_VALUES}
+
+    def marginal(array, key):
+        # Totals by one key, without the slot of the missing values
+        axis = AGGREGATE_KEYS.index(key)
+        return array.sum(axis=tuple(i for i in range(len(shape)) if i != axis))[:-1]
+
+    groupings = marketing_groupings({key: (marginal(counts, key), {value: marginal(sums[value], key) for value in AGGREGATE_VALUES})
+                                     for key in AGGREGATE_KEYS})
+    groupings['cohort_daily'] = cohort_series(df)
+    return groupings
+
+
+def aggregate_labels(key):
+    """
+    Returns the labels of a group key of AGGREGATE_KEYS, in the order of the
+    totals given to marketing_groupings: its categories, or 0 and 1.
+    """
+    dtype = MARKETING_SCHEMA[key]
+    if isinstance(dtype, pd.CategoricalDtype):
+        return list(dtype.categories)
+    return [0, 1]
+
+
+def marketing_groupings(totals):
+    """
+    Builds the groupings returned by aggregate_marketing from the totals by
+    each key: totals maps every key of AGGREGATE_KEYS to the number of rows
+    and the dict of sums of every AGGREGATE_VALUES for each of its labels
+    (see aggregate_labels). Missing values of the key are not counted.
+    """
+    def grouped(key, values, observed=False):
+        n, sums = totals[key]
+        key_labels = aggregate_labels(key)
+        if isinstance(MARKETING_SCHEMA[key], pd.CategoricalDtype):
+            key_labels = pd.Categorical(key_labels, dtype=MARKETING_SCHEMA[key]) if not observed else [str(label) for label in key_labels]
+        result = pd.DataFrame({key: key_labels})
+        for value in values:
+            total = sums[value]
+            result[value] = np.divide(total, n, out=np.full(len(n), np.nan), where=n > 0)
+        return result[n > 0].reset_index(drop=True) if observed else result
+
+    return {
+        'purchases_by_age': grouped('Age_Range', PURCHASE_COLUMNS),
+        'purchases_by_income': grouped('Income_Range', PURCHASE_COLUMNS),
+        'visits_by_age': grouped('Age_Range', ['NumWebVisitsMonth']),
+        'wine_by_education': grouped('Education_Level', ['MntWines'], observed=True),
+        'wine_by_parent': grouped('Is_Parent', ['MntWines'], observed=True),
+        'wine_by_living_status': grouped('Living_Status', ['MntWines'], observed=True),
+    }
+
+
+def daily_cohorts(days, customers, sums):
+    """
+    Returns the daily cohort series (see cohort_series) from the enrollment
+    days, the customers enrolled each day and the dict of sums of every
+    COHORT_VALUES each day. The days without customers are added with zeros.
+    """
+    series = pd.DataFrame({'Customers': np.asarray(customers, dtype='int64'),
+                           **{value: np.asarray(sums[value], dtype='float64') for value in COHORT_VALUES}},
+                          index=pd.DatetimeIndex(days, name='Day').astype('datetime64[ns]'))
+    if len(series) == 0:
+        return series
+    return series.reindex(pd.date_range(series.index.min(), series.index.max(), freq='D', name='Day'), fill_value=0)
+
+
+def cohort_series(df):
+    """
+    Returns the enrollment cohorts of df as a daily series: for every day from
+    the first to the last Dt_Customer, the number of customers who enrolled
+    that day ('Customers') and the sums of their COHORT_VALUES.
+
+    The day of every customer is counted with one np.bincount per value, and
+    any view of the cohorts (see cohort_view) is then a re-bucketing of this
+    series, whose size depends on the days and not on the customers.
+    """
+    days = df['Dt_Customer'].to_numpy().astype('datetime64[D]')
+    valid = ~np.isnat(days)
+    days = days[valid]
+    if len(days) == 0:
+        return daily_cohorts([], [], {value: [] for value in COHORT_VALUES})
+
+    first = days.min()
+    codes = (days - first).astype('int64')
+    size = int(codes.max()) + 1
+    customers = np.bincount(codes, minlength=size)
+    sums = {value: np.bincount(codes, weights=df[value].to_numpy(dtype='float64')[valid], minlength=size) for value in COHORT_VALUES}
+    return daily_cohorts(first + np.arange(size), customers, sums)
+
+
+def cohort_view(series, view=COHORT_VIEWS[0], window=COHORT_WINDOW):
+    """
+    Re-buckets a daily cohort series into one of the COHORT_VIEWS:
+
+    - 'Month of year': totals of every month of the year with customers (1 to 12).
+    - 'Calendar month' and 'Quarter': totals of every month / quarter, by its first day.
+    - 'Rolling N days': totals of the last window days, for every day.
+
+    Returns a DataFrame with the 'Period' and the columns of the series.
+    """
+    if view == 'Month of year':
+        totals = series.groupby(series.index.month).sum()
+        totals = totals[totals['Customers'] > 0]
+    elif view == 'Calendar month':
+        totals = series.resample('MS').sum()
+    elif view == 'Quarter':
+        totals = series.resample('QS').sum()
+    elif view == f'Rolling {window} days':
+        totals = series.rolling(window, min_periods=1).sum()
+    else:
+        raise ValueError(f'Unknown cohort view {view!r}, expected one of {COHORT_VIEWS}')
+    return totals.rename_axis('Period').reset_index()
+
+
+def chart_aggregates(df):
+    """
+    Returns the aggregates of the marketing charts: df itself when it already
+    is the result of aggregate_marketing, otherwise aggregate_marketing(df).
+    """
+    return df if isinstance(df, dict) else aggregate_marketing(df)
+
+
 def site_purchases_by_age(df_wine):
     """
     Creates a bar plot of the average purchases by age range
     """
     # Calculate the average purchases by age range
-    age_grouped = df_wine.groupby('Age_Range', observed=False).agg({
-        'NumDealsPurchases': 'mean',
-        'NumWebPurchases': 'mean',
-        'NumCatalogPurchases': 'mean',
-        'NumStorePurchases': 'mean',
-    }).reset_index()
+    age_grouped = chart_aggregates(df_wine)['purchases_by_age']
 
     # Create the bar plot
     bar_width = 0.15
@@ -99,30 +311,31 @@ def site_purchases_by_age(df_wine):
     r3 = [x + bar_width for x in r2]
     r4 = [x + bar_width for x in r3]
 
-    plt.figure(figsize=(9, 4))
+    fig = new_figure(figsize=(9, 4))
+    ax = fig.subplots()
 
-    plt.bar(r1, age_grouped['NumDealsPurchases'], color='#a3c2c2', width=bar_width, edgecolor='grey', label='Deals Purchases')
-    plt.bar(r2, age_grouped['NumWebPurchases'], color='#f2b5d4', width=bar_width, edgecolor='grey', label='Web Purchases')
-    plt.bar(r3, age_grouped['NumCatalogPurchases'], color='#c5a3ff', width=bar_width, edgecolor='grey', label='Catalog Purchases')
-    plt.bar(r4, age_grouped['NumStorePurchases'], color='#f6cfb7', width=bar_width, edgecolor='grey', label='Store Purchases')
+    ax.bar(r1, age_grouped['NumDealsPurchases'], color='#a3c2c2', width=bar_width, edgecolor='grey', label='Deals Purchases')
+    ax.bar(r2, age_grouped['NumWebPurchases'], color='#f2b5d4', width=bar_width, edgecolor='grey', label='Web Purchases')
+    ax.bar(r3, age_grouped['NumCatalogPurchases'], color='#c5a3ff', width=bar_width, edgecolor='grey', label='Catalog Purchases')
+    ax.bar(r4, age_grouped['NumStorePurchases'], color='#f6cfb7', width=bar_width, edgecolor='grey', label='Store Purchases')
 
     # Set the x-axis label
-    plt.xlabel('Age range')
+    ax.set_xlabel('Age range')
 
     # Set the x-axis tick labels
-    plt.xticks([r + bar_width*2 for r in range(len(age_grouped))], age_grouped['Age_Range'], rotation=0)
+    ax.set_xticks([r + bar_width*2 for r in range(len(age_grouped))], age_grouped['Age_Range'], rotation=0)
 
     # Set the y-axis label
-    plt.ylabel('Average purchases')
+    ax.set_ylabel('Average purchases')
 
     # Set the legend
-    plt.legend(loc='upper left',bbox_to_anchor=(-0.1, 1))
+    ax.legend(loc='upper left',bbox_to_anchor=(-0.1, 1))
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def site_purchases_by_income(df_wine):
@@ -130,12 +343,7 @@ def site_purchases_by_income(df_wine):
     Creates a bar plot of the average purchases by income range.
     """
     # Calculate the mean of the number of purchases by income range
-    income_grouped = df_wine.groupby('Income_Range', observed=False).agg({
-        'NumDealsPurchases': 'mean',
-        'NumWebPurchases': 'mean',
-        'NumCatalogPurchases': 'mean',
-        'NumStorePurchases': 'mean',
-    }).reset_index()
+    income_grouped = chart_aggregates(df_wine)['purchases_by_income']
 
     # Set the bar width
     bar_width = 0.15
@@ -150,31 +358,32 @@ def site_purchases_by_income(df_wine):
     r4 = [x + bar_width for x in r3]
 
     # Create the figure
-    plt.figure(figsize=(10, 4))
+    fig = new_figure(figsize=(10, 4))
+    ax = fig.subplots()
 
     # Plot the bars
-    plt.bar(r1, income_grouped['NumDealsPurchases'], color='#a3c2c2', width=bar_width, edgecolor='grey', label='Deals Purchases')
-    plt.bar(r2, income_grouped['NumWebPurchases'], color='#f2b5d4', width=bar_width, edgecolor='grey', label='Web Purchases')
-    plt.bar(r3, income_grouped['NumCatalogPurchases'], color='#c5a3ff', width=bar_width, edgecolor='grey', label='Catalog Purchases')
-    plt.bar(r4, income_grouped['NumStorePurchases'], color='#f6cfb7', width=bar_width, edgecolor='grey', label='Store Purchases')
+    ax.bar(r1, income_grouped['NumDealsPurchases'], color='#a3c2c2', width=bar_width, edgecolor='grey', label='Deals Purchases')
+    ax.bar(r2, income_grouped['NumWebPurchases'], color='#f2b5d4', width=bar_width, edgecolor='grey', label='Web Purchases')
+    ax.bar(r3, income_grouped['NumCatalogPurchases'], color='#c5a3ff', width=bar_width, edgecolor='grey', label='Catalog Purchases')
+    ax.bar(r4, income_grouped['NumStorePurchases'], color='#f6cfb7', width=bar_width, edgecolor='grey', label='Store Purchases')
 
     # Set the x-axis label
-    plt.xlabel('Range income')
+    ax.set_xlabel('Range income')
 
     # Set the x-axis tick labels
-    plt.xticks([r + bar_width*2 for r in range(len(income_grouped))], income_grouped['Income_Range'], rotation=0)
+    ax.set_xticks([r + bar_width*2 for r in range(len(income_grouped))], income_grouped['Income_Range'], rotation=0)
 
     # Set the y-axis label
-    plt.ylabel('Average purchases')
+    ax.set_ylabel('Average purchases')
 
     # Set the legend
-    plt.legend()
+    ax.legend()
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def web_visits_by_age(df_wine):
@@ -182,78 +391,200 @@ def web_visits_by_age(df_wine):
     Creates a bar plot of the average number of website visits by age range.
     """
     # Calculate the average number of website visits by age range
-    avg_visits = df_wine.groupby('Age_Range', observed=False)['NumWebVisitsMonth'].mean().reset_index()
+    avg_visits = chart_aggregates(df_wine)['visits_by_age']
 
     # Sort the dataframe by age range
     avg_visits = avg_visits.sort_values(by='Age_Range')
 
     # Create the figure
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the bars
-    sns.barplot(x='Age_Range', y='NumWebVisitsMonth', data=avg_visits, palette='pastel', hue='Age_Range', legend=False)
+    import seaborn as sns
+    sns.barplot(x='Age_Range', y='NumWebVisitsMonth', data=avg_visits, palette='pastel', hue='Age_Range', legend=False, ax=ax)
 
     # Set the x-axis label
-    plt.xlabel('Age range')
+    ax.set_xlabel('Age range')
 
     # Set the y-axis label
-    plt.ylabel('Average visits in the website')
+    ax.set_ylabel('Average visits in the website')
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
-def purchases_by_income(df_income):
+def density_grid(x, y, bins=DENSITY_BINS):
+    """
+    Counts the (x, y) points in a grid of bins[0] x bins[1] equal bins over
+    their range, ignoring the pairs with a missing value.
+
+    Returns the counts (shape bins) and the edges of the x and y bins. The
+    bin of every point is computed arithmetically and counted with a single
+    np.bincount, so the cost is linear in the points with no sorting.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if len(x) == 0:
+        return np.zeros(bins, dtype='int64'), np.linspace(0, 1, bins[0] + 1), np.linspace(0, 1, bins[1] + 1)
+
+    # Edges of the grid (a constant column gets a bin of width 1)
+    edges = []
+    cells = []
+    for values, n in ((x, bins[0]), (y, bins[1])):
+        low, high = values.min(), values.max()
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        edges.append(np.linspace(low, high, n + 1))
+        cells.append(np.minimum(((values - low) * (n / (high - low))).astype('int64'), n - 1))
+
+    counts = np.bincount(cells[0] * bins[1] + cells[1], minlength=bins[0] * bins[1]).reshape(bins)
+    return counts, edges[0], edges[1]
+
+
+def _plot_income_wine(ax, df_income, density=None):
+    """
+    Draws the wine purchases against income of df_income on ax: one marker per
+    customer, or a density grid when density is True. By default the density grid
+    is used from DENSITY_MIN_ROWS customers, so the drawing cost is bounded by the
+    size of the grid instead of the number of customers.
+    """
+    if density is None:
+        density = len(df_income) >= DENSITY_MIN_ROWS
+
+    if not density:
+        ax.scatter(df_income['Income'], df_income['MntWines'], color='#6a9ac4', alpha=0.7, edgecolor='k')
+        return
+
+    # Empty bins are left blank and the counts are shown on a log scale
+    from matplotlib.colors import LogNorm
+    counts, x_edges, y_edges = density_grid(df_income['Income'], df_income['MntWines'])
+    counts = np.ma.masked_equal(counts.T, 0)
+
+    # Without customers every bin is masked and the log scale has no range
+    if counts.count() == 0:
+        return
+    mesh = ax.pcolormesh(x_edges, y_edges, counts, cmap='Blues', norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)))
+    ax.figure.colorbar(mesh, ax=ax, label='Customers')
+
+
+def purchases_by_income(df_income, density=None):
     """
     Creates a scatter plot of the relationship between income and wine purchases.
+    With many customers it becomes a density grid (see _plot_income_wine).
     """
     # Create the figure
 
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the scatter plot
-    plt.scatter(df_income['Income'], df_income['MntWines'], color='#6a9ac4', alpha=0.7, edgecolor='k')
+    _plot_income_wine(ax, df_income, density)
 
     # Set the x-axis label
-    plt.xlabel('Incomes')
+    ax.set_xlabel('Incomes')
 
     # Set the y-axis label
-    plt.ylabel('Wine purchases')
+    ax.set_ylabel('Wine purchases')
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
-def purchases_by_income_line(df_income):
+def _t_quantile(df):
     """
-    Creates a scatter plot of the relationship between income and wine purchases with a regression line.
+    Returns the two-sided 95% quantile of Student's t with df degrees of freedom:
+    from T_975 up to 30, and above from the Cornish-Fisher expansion around the
+    normal quantile 1.96 (within 1e-4 of the exact value), so scipy is not needed.
+    """
+    if df <= len(T_975):
+        return T_975[df - 1]
+    z = 1.959964
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+def linear_fit(x, y, points=100):
+    """
+    Fits y = slope * x + intercept by ordinary least squares in closed form,
+    ignoring the pairs with a missing value.
+
+    Returns a dict with the slope, intercept, R², number of points n and the
+    fitted line on a grid of points over the range of x ('x', 'y'), with the
+    lower and upper bounds of its 95% confidence band ('lower', 'upper').
+    The band uses the standard error of the mean response and the Student t
+    quantile with n - 2 degrees of freedom, so it widens when only a few points
+    are left, instead of bootstrapping it as sns.regplot does.
+    Returns None if there are fewer than 3 points or x is constant.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    n = len(x)
+    if n < 3:
+        return None
+
+    # Sums of squares around the means
+    x_mean, y_mean = x.mean(), y.mean()
+    dx, dy = x - x_mean, y - y_mean
+    sxx, sxy, syy = dx @ dx, dx @ dy, dy @ dy
+    if sxx == 0:
+        return None
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    sse = max(syy - slope * sxy, 0.0)
+
+    # Line and confidence band of the mean response
+    grid = np.linspace(x.min(), x.max(), points)
+    line = intercept + slope * grid
+    se = np.sqrt(sse / (n - 2) * (1 / n + (grid - x_mean) ** 2 / sxx))
+    t = _t_quantile(n - 2)
+    return {'slope': slope, 'intercept': intercept, 'r2': 1 - sse / syy if syy > 0 else 1.0, 'n': n,
+            'x': grid, 'y': line, 'lower': line - t * se, 'upper': line + t * se}
+
+
+def purchases_by_income_line(df_income, density=None):
+    """
+    Creates a scatter plot of the relationship between income and wine purchases with a regression line,
+    its 95% confidence band and the slope, intercept and R² of the fit in the legend.
+    With many customers the scatter plot becomes a density grid (see _plot_income_wine).
     """
 
     # Create the figure
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the scatter plot
-    sns.regplot(x='Income', y='MntWines', data=df_income, 
-                scatter_kws={'color': '#6a9ac4', 'alpha': 0.7, 'edgecolor': 'k'}, 
-                line_kws={'color': 'red', 'lw': 2})
+    _plot_income_wine(ax, df_income, density)
+
+    # Plot the regression line and its confidence band
+    fit = linear_fit(df_income['Income'], df_income['MntWines'])
+    if fit is not None:
+        label = f"y = {fit['slope']:.4f}x {'+' if fit['intercept'] >= 0 else '-'} {abs(fit['intercept']):.1f}   R² = {fit['r2']:.3f}"
+        ax.plot(fit['x'], fit['y'], color='red', lw=2, label=label)
+        ax.fill_between(fit['x'], fit['lower'], fit['upper'], color='red', alpha=0.15, linewidth=0)
+        ax.legend(loc='upper left')
 
     # Set the x-axis label
-    plt.xlabel('Incomes')
+    ax.set_xlabel('Incomes')
 
     # Set the y-axis label
-    plt.ylabel('Wine purchases')
+    ax.set_ylabel('Wine purchases')
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def purchases_by_education(df):
@@ -261,31 +592,33 @@ def purchases_by_education(df):
     Creates a bar plot of the average number of wine purchases by education level.
     """
     # Calculate the average number of purchases by education level
-    education_mean = df.groupby('Education_Level')['MntWines'].mean().reset_index()
+    education_mean = chart_aggregates(df)['wine_by_education']
 
     # Sort the DataFrame by the average number of purchases
     education_mean = education_mean.sort_values(by='MntWines')
 
     # Create the figure
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the bars
-    sns.barplot(x='Education_Level', y='MntWines', data=education_mean, palette='pastel', hue='Education_Level')
+    import seaborn as sns
+    sns.barplot(x='Education_Level', y='MntWines', data=education_mean, palette='pastel', hue='Education_Level', ax=ax)
 
     # Set the x-axis label
-    plt.xlabel('Education level')
+    ax.set_xlabel('Education level')
 
     # Set the y-axis label
-    plt.ylabel('Average purchases wine')
+    ax.set_ylabel('Average purchases wine')
 
     # Rotate the x-axis labels
-    plt.xticks(rotation=0)
+    ax.tick_params(axis='x', labelrotation=0)
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def son_at_home(df):
@@ -294,19 +627,21 @@ def son_at_home(df):
     with a son at home and those without a son at home.
     """
     # Calculate the mean number of purchases by customers with a son at home and those without a son at home
-    parent_mean = df.groupby('Is_Parent')['MntWines'].mean().reset_index()
+    parent_mean = chart_aggregates(df)['wine_by_parent']
 
     # Map the values of the 'Is_Parent' column to the labels for the pie chart
-    parent_mean['Is_Parent'] = parent_mean['Is_Parent'].map({0: 'Not son at home', 1: 'Son at home'})
+    # (on a copy, as the aggregates are shared by every marketing chart)
+    parent_mean = parent_mean.assign(Is_Parent=parent_mean['Is_Parent'].map({0: 'Not son at home', 1: 'Son at home'}))
 
     # Create the figure
-    plt.figure(figsize=(7, 7))
+    fig = new_figure(figsize=(7, 7))
+    ax = fig.subplots()
 
     # Plot the pie chart
-    plt.pie(parent_mean['MntWines'], labels=parent_mean['Is_Parent'], autopct='%1.1f%%', colors=['#ff9999','#66b3ff'], startangle=140)
+    ax.pie(parent_mean['MntWines'], labels=parent_mean['Is_Parent'], autopct='%1.1f%%', colors=['#ff9999','#66b3ff'], startangle=140)
 
     # Return the figure
-    return plt
+    return fig
 
 
 def purchases_by_living_status(df):
@@ -314,58 +649,68 @@ def purchases_by_living_status(df):
     Creates a bar plot of the average number of wine purchases by living status.
     """
     # Calculate the mean number of purchases by living status
-    spend_by_livingstatus = df.groupby('Living_Status')['MntWines'].mean().reset_index()
+    spend_by_livingstatus = chart_aggregates(df)['wine_by_living_status']
 
     # Create the figure
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the bars
-    ax = sns.barplot(x='Living_Status', y='MntWines', data=spend_by_livingstatus, palette='pastel', hue='Living_Status')
+    import seaborn as sns
+    sns.barplot(x='Living_Status', y='MntWines', data=spend_by_livingstatus, palette='pastel', hue='Living_Status', ax=ax)
 
     # Set the x-axis label
-    plt.xlabel('Living status')
+    ax.set_xlabel('Living status')
 
     # Set the y-axis label
-    plt.ylabel('Average purchases wine')
+    ax.set_ylabel('Average purchases wine')
 
     # Add the actual values to the bars
     for i, row in spend_by_livingstatus.iterrows():
         ax.text(i, row['MntWines'] + 0.5, f'{row["MntWines"]:.2f}', ha='center')
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
-def purchases_by_month(df):
+def purchases_by_month(df, view=COHORT_VIEWS[0]):
     """
-    Creates a bar plot of the total number of wine purchases per month.
+    Creates a plot of the total wine purchases by date of enrollment of the
+    customers, in one of the COHORT_VIEWS: bars by month of the year (the
+    default), by calendar month or by quarter, or a line of the rolling total.
     """
-    # Create a new column with the month of the customer
-    df['Month'] = df['Dt_Customer'].dt.month
-
-    # Calculate the total number of purchases per month
-    monthly_sales = df.groupby('Month')['MntWines'].sum().reset_index()
+    # Re-bucket the daily cohorts of the customers into the view
+    sales = cohort_view(chart_aggregates(df)['cohort_daily'], view)
 
     # Create the figure
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
-    # Plot the bars
-    plt.bar(monthly_sales['Month'], monthly_sales['MntWines'], color='#4a90e2')
+    # Plot the bars (or the line of the rolling window)
+    if view == 'Month of year':
+        ax.bar(sales['Period'], sales['MntWines'], color='#4a90e2')
+    elif view in ('Calendar month', 'Quarter'):
+        ax.bar(sales['Period'], sales['MntWines'], width=25 if view == 'Calendar month' else 80, align='edge', color='#4a90e2')
+    else:
+        ax.plot(sales['Period'], sales['MntWines'], color='#4a90e2')
 
     # Set the x-axis label
-    plt.xlabel('Month')
+    ax.set_xlabel('Month' if view == 'Month of year' else 'Enrollment date')
 
     # Set the y-axis label
-    plt.ylabel('Total purchases wine')
+    ax.set_ylabel('Total purchases wine' if view != COHORT_VIEWS[-1] else f'Purchases wine, last {COHORT_WINDOW} days')
 
     # Set the x-axis tick labels
-    plt.xticks(ticks=range(1, 13), labels=['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'])
+    if view == 'Month of year':
+        ax.set_xticks(ticks=range(1, 13), labels=['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'])
+    else:
+        fig.autofmt_xdate()
 
     # Set the figure layout tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
\ No newline at end of file
+    return fig
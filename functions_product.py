@@ -1,68 +1,141 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-
-
-def read_df_product():
+from functions_snapshot import read_snapshot
+from functions_schema import apply_schema
+from functions_render import new_figure
+
+
+# Path of the INE consumers table, its survey year (a2003 in the INEbase path)
+# and version of clean_df_product (bump it when its output changes)
+PRODUCT_PATH = 'datasets/consumers.xls'
+PRODUCT_YEAR = 2003
+CLEAN_VERSION = 5
+
+# Positions of the columns of the INE table used by the wine consume study
+PRODUCT_COLUMNS = list(range(7))
+
+# Labels of the INE table: sections, sexes and age ranges of the first column,
+# and frequency bands of the other columns (the last four + '4+' are consumers)
+INE_MEASURES = {'CIFRAS ABSOLUTAS': 'absolute', 'CIFRAS RELATIVAS': 'relative'}
+INE_SEXES = {'Ambos sexos': 'Both', 'Varones': 'Men', 'Mujeres': 'Women'}
+INE_AGES = {
+    'Total': 'Total',
+    'De 16 a 24 años': '16-24',
+    'De 25 a 34 años': '25-34',
+    'De 35 a 44 años': '35-44',
+    'De 45 a 54 años': '45-54',
+    'De 55 a 64 años': '55-64',
+    'De 65 a 74 años': '65-74',
+    'De 75 y más años': '75+',
+}
+INE_BANDS = ['total', '4+', '1-3', '-1', '<<1', '0']
+CONSUMER_BANDS = ['4+', '1-3', '-1', '<<1']
+
+# Columns and types of the cleaned tables (see apply_schema). The age ranges stay
+# strings so the charts only show the ranges selected by the user
+PRODUCT_SCHEMA = {
+    'years': 'str',
+    '0': 'float',
+    'total_cons': 'float',
+}
+
+
+def read_df_product(url=PRODUCT_PATH):
     """
     Reads the consumers.xls dataset from the datasets folder into a pandas DataFrame.
+
+    Only the columns in PRODUCT_COLUMNS are read. The Arrow snapshot of the
+    dataset is used when it is up to date, otherwise the Excel file is parsed.
     """
-    url = 'datasets/consumers.xls'
-    df_product = pd.read_excel(url)
+    df_product = read_snapshot(url, PRODUCT_COLUMNS)
+    if df_product is None:
+        df_product = pd.read_excel(url, usecols=PRODUCT_COLUMNS)
     return df_product
 
 
-def clean_df_product(df):
+def ine_long(df, year=PRODUCT_YEAR):
     """
-    Clean the consumers.xls dataset by performing the following operations:
-
-    1. Rename columns to strip leading and trailing whitespace.
-    2. Drop duplicate rows.
-    3. Replace values in the 'years' column with more readable labels.
-    4. Create a new column 'total_cons' by summing the '4+', '1-3', '-1', and '<<1' columns.
-    5. Drop the 'total', '4+', '1-3', '-1', and '<<1' columns.
-    6. Split the dataset into three DataFrames: df_both, df_men, and df_women.
-
-    Returns a tuple of three DataFrames: df_both, df_men, and df_women.
-    """
-    # Rename columns to strip leading and trailing whitespace
-    df = df.iloc[:,:7].copy()
-    name_columns =  ['years','total','4+', '1-3', '-1','<<1','0']
-    df.columns = name_columns
-
-    # Replace values in the 'years' column with more readable labels
-    df['years'] = df['years'].replace({
-        '        Total':'Total',
-        '        De 16 a 24 años': '16-24',
-        '        De 25 a 34 años': '25-34',
-        '        De 35 a 44 años': '35-44',
-        '        De 45 a 54 años': '45-54',
-        '        De 55 a 64 años': '55-64',
-        '        De 65 a 74 años': '65-74',
-        '        De 75 y más años': '75+'
+    Parses a raw INE consumers table into long format, with one row per
+    year, measure ('absolute' or 'relative'), sex, age range and frequency band.
+
+    The sections, sexes and age ranges are recognised by their labels in the
+    first column (see INE_MEASURES, INE_SEXES and INE_AGES), not by the
+    position of the rows, so tables with other layouts or years are parsed too.
+    """
+    labels = df.iloc[:, 0].astype('str').str.strip()
+
+    # Every row takes the measure and sex of the last heading above it
+    keys = pd.DataFrame({
+        'measure': labels.map(INE_MEASURES).ffill(),
+        'sex': labels.map(INE_SEXES).ffill(),
+        'age': labels.map(INE_AGES),
     })
+    rows = keys.notna().all(axis=1)
 
-    # Create a new column 'total_cons' by summing the '4+', '1-3', '-1', and '<<1' columns
-    df_both = df.loc[37:44].copy()
-    df_both.index = range(1, len(df_both)+1)
-    df_both['total_cons'] = df_both['4+']+df_both['1-3']+df_both['-1']+df_both['<<1']
+    # One row per frequency band
+    values = df.loc[rows].iloc[:, 1:len(INE_BANDS) + 1].apply(pd.to_numeric)
+    values.columns = INE_BANDS
+    wide = pd.concat([keys.loc[rows], values], axis=1)
+    long = wide.melt(id_vars=['measure', 'sex', 'age'], var_name='band', value_name='value')
+    long.insert(0, 'year', year)
+    return long
 
-    # Drop the 'total', '4+', '1-3', '-1', and '<<1' columns
-    df_both = df_both.drop(columns=['total','4+', '1-3', '-1','<<1'])
 
-    # Split the dataset into three DataFrames: df_both, df_men, and df_women
-    df_men = df.loc[46:53].copy()
-    df_men.index = range(1, len(df_men)+1)
-    df_men['total_cons'] = df_men['4+']+df_men['1-3']+df_men['-1']+df_men['<<1']
-    df_men = df_men.drop(columns=['total', '4+', '1-3', '-1','<<1'])
+def build_product_store(tables):
+    """
+    Builds the store of the INE consumers tables from a dict mapping each survey year to its raw table.
+
+    Returns a long DataFrame with a single 'value' column indexed by
+    (year, measure, sex, age, band). The keys are categoricals and the index
+    is sorted, so any slice is found with a binary search on the index.
+    """
+    store = pd.concat([ine_long(df, year) for year, df in tables.items()], ignore_index=True)
+    for key, categories in [('measure', list(INE_MEASURES.values())), ('sex', list(INE_SEXES.values())),
+                            ('age', list(INE_AGES.values())), ('band', INE_BANDS)]:
+        store[key] = pd.Categorical(store[key], categories=categories, ordered=True)
+    return store.set_index(['year', 'measure', 'sex', 'age', 'band']).sort_index()
 
-    df_women = df.loc[55:62].copy()
-    df_women.index = range(1, len(df_women)+1)
-    df_women['total_cons'] = df_women['4+']+df_women['1-3']+df_women['-1']+df_women['<<1']
-    df_women = df_women.drop(columns=['total', '4+', '1-3', '-1','<<1'])
 
-    return df_both, df_men, df_women
+def read_product_store(paths):
+    """
+    Reads and parses the INE consumers tables of several survey years at once.
+    paths maps every year to the path of its table.
+    """
+    return build_product_store({year: read_df_product(path) for year, path in paths.items()})
+
+
+def product_table(store, sex, year=PRODUCT_YEAR, measure='relative'):
+    """
+    Returns the table of one sex ('Both', 'Men' or 'Women') used by the
+    charts: one row per age range (first the total) with the percentage of
+    non consumers ('0') and of consumers ('total_cons', the sum of the
+    CONSUMER_BANDS), typed with PRODUCT_SCHEMA.
+
+    The rows are indexed by their age range, so the charts and the app take
+    them with .loc, e.g. table.loc['Total', 'total_cons'].
+    """
+    bands = store.loc[(year, measure, sex), 'value'].unstack('band')
+
+    # The sum is written out so the result does not depend on the summation order of pandas
+    ages = bands.index.astype('str')
+    table = pd.DataFrame({
+        'years': ages,
+        '0': bands['0'].to_numpy(),
+        'total_cons': (bands['4+'] + bands['1-3'] + bands['-1'] + bands['<<1']).to_numpy(),
+    }, index=pd.Index(ages, name='age'))
+    return apply_schema(table, PRODUCT_SCHEMA)
+
+
+def clean_df_product(df):
+    """
+    Cleans the consumers.xls dataset by parsing it into the long-format store
+    of build_product_store (the relative and absolute figures of every sex,
+    age range and frequency band).
+
+    The tables of the charts are taken from the store with product_table.
+
+    Returns the store DataFrame.
+    """
+    return build_product_store({PRODUCT_YEAR: df})
 
 
 def consume_wine(df_both):
@@ -78,7 +151,8 @@ def consume_wine(df_both):
     colors = ['#A3E4D7', '#FAD7A0']
 
     # Create the figure and axis
-    fig, ax = plt.subplots(figsize=(8, 6))
+    fig = new_figure(figsize=(8, 6))
+    ax = fig.subplots()
 
     # Plot the pie chart
     ax.pie(values, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90)
@@ -87,7 +161,7 @@ def consume_wine(df_both):
     ax.axis('equal')
 
     # Return the figure
-    return plt
+    return fig
 
 
 def consume_m_w_by_age(df_men, df_women, x):
@@ -96,74 +170,76 @@ def consume_m_w_by_age(df_men, df_women, x):
     """
     # Filter the data to only include the age ranges (not the total)
     if x != 2:
-        df_men_filtered = df_men[df_men['years'] != 'Total']
+        df_men_filtered = df_men.drop(index='Total')
     if x != 1:
-        df_women_filtered = df_women[df_women['years'] != 'Total']
+        df_women_filtered = df_women.drop(index='Total')
 
     # Create the figure and axis
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     # Plot the men's data if requested
     if x != 2:
-        plt.plot(df_men_filtered['years'], df_men_filtered['total_cons'], marker='o', label='Men', color='#a3c2c2')
+        ax.plot(df_men_filtered['years'], df_men_filtered['total_cons'], marker='o', label='Men', color='#a3c2c2')
         # Add the percentages as text
         for i in range(len(df_men_filtered)):
-            plt.text(i, df_men_filtered['total_cons'].iloc[i] + 1, 
+            ax.text(i, df_men_filtered['total_cons'].iloc[i] + 1, 
                      f'{df_men_filtered["total_cons"].iloc[i]:.2f}%', 
                      ha='center', va='bottom', color='#a3c2c2')
 
     # Plot the women's data if requested
     if x != 1:
-        plt.plot(df_women_filtered['years'], df_women_filtered['total_cons'], marker='o', label='Women', color='#f2b5d4')
+        ax.plot(df_women_filtered['years'], df_women_filtered['total_cons'], marker='o', label='Women', color='#f2b5d4')
         # Add the percentages as text
         for i in range(len(df_women_filtered)):
-            plt.text(i, df_women_filtered['total_cons'].iloc[i] + 1, 
+            ax.text(i, df_women_filtered['total_cons'].iloc[i] + 1, 
                      f'{df_women_filtered["total_cons"].iloc[i]:.2f}%', 
                      ha='center', va='bottom', color='#f2b5d4')
 
     # Set the x and y labels
-    plt.xlabel('Age range')
-    plt.ylabel('Consumers (%)')
+    ax.set_xlabel('Age range')
+    ax.set_ylabel('Consumers (%)')
 
     # Add a legend
-    plt.legend()
+    ax.legend()
 
     # Add a grid
-    plt.grid(True, linestyle='--', alpha=0.7)
+    ax.grid(True, linestyle='--', alpha=0.7)
 
     # Set the layout to be tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Return the figure
-    return plt
+    return fig
 
 
 def consume_men_women(df_men, df_women):
     """
     Creates a bar chart of the percentage of consumers for men and women.
     """
-    total_men = df_men[df_men['years'] == 'Total']
-    total_women = df_women[df_women['years'] == 'Total']
+    total_men = df_men.loc['Total', 'total_cons']
+    total_women = df_women.loc['Total', 'total_cons']
 
     # Create the figure and axis
-    plt.figure(figsize=(9, 5))
+    fig = new_figure(figsize=(9, 5))
+    ax = fig.subplots()
 
     # Plot the men's data
-    plt.bar('Men', total_men['total_cons'].values[0], color='#a3c2c2') 
+    ax.bar('Men', total_men, color='#a3c2c2') 
     # Plot the women's data
-    plt.bar('Women', total_women['total_cons'].values[0], color='#f2b5d4') 
+    ax.bar('Women', total_women, color='#f2b5d4') 
 
     # Set the y-axis label
-    plt.ylabel('Consumers (%)')
+    ax.set_ylabel('Consumers (%)')
     # Set the layout to be tight
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Add the percentages as text
-    for index, value in enumerate([total_men['total_cons'].values[0], total_women['total_cons'].values[0]]):
-        plt.text(index, value + 1, f'{value:.2f}%', ha='center', va='bottom', fontsize=10, color='black')
+    for index, value in enumerate([total_men, total_women]):
+        ax.text(index, value + 1, f'{value:.2f}%', ha='center', va='bottom', fontsize=10, color='black')
 
     # Return the figure
-    return plt
+    return fig
 
 
 def consume_by_age(df_both):
@@ -171,16 +247,18 @@ def consume_by_age(df_both):
     Creates a bar chart of the total consumption of wine for each age range.
     """
     # Create the figure with the specified size
-    plt.figure(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
     # Create the bar plot with the specified data and colors
-    ax = sns.barplot(x='years', y='total_cons', data=df_both.loc[1:], palette='viridis',hue='total_cons', legend=False)
+    import seaborn as sns
+    sns.barplot(x='years', y='total_cons', data=df_both, palette='viridis',hue='total_cons', legend=False, ax=ax)
 
     # Set the x-axis label
-    plt.xlabel('Age range')
+    ax.set_xlabel('Age range')
     # Set the y-axis label
-    plt.ylabel('Total consumption (%)')
+    ax.set_ylabel('Total consumption (%)')
     # Rotate the x-axis tick labels
-    plt.xticks(rotation=30) 
+    ax.tick_params(axis='x', labelrotation=30) 
     # Iterate over the bars and add the percentages as text
     for p in ax.patches:
         height = p.get_height()
@@ -192,6 +270,6 @@ def consume_by_age(df_both):
                     textcoords='offset points')
 
     # Set the layout to be tight
-    plt.tight_layout()
+    fig.tight_layout()
     # Return the figure
-    return plt
\ No newline at end of file
+    return fig
\ No newline at end of file
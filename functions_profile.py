@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import marshal
+import cProfile
+import threading
+from contextlib import contextmanager
+
+
+# Modes of the profiling panel and interval between two samples of the sampling profiler
+PROFILE_MODES = ['Off', 'Timings', 'cProfile', 'Sampling']
+SAMPLE_INTERVAL = 0.005
+
+# Timings of the rerun running in the current thread (None when they are not recorded)
+_state = threading.local()
+
+
+@contextmanager
+def timed(stage, name):
+    """
+    Records the time spent in the block under a stage ('read', 'clean',
+    'plot', ...) and a name, if the current rerun is being profiled.
+    Otherwise it only checks a thread-local attribute.
+    """
+    timings = getattr(_state, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append({'stage': stage, 'name': name, 'ms': (time.perf_counter() - start) * 1000})
+
+
+def current_timings():
+    """
+    Returns the list where the timings of the current thread are recorded, or None.
+    """
+    return getattr(_state, 'timings', None)
+
+
+@contextmanager
+def recording_to(timings):
+    """
+    Records the timed stages of the block, run in another thread, to the timings
+    of a rerun (see current_timings). Nothing is recorded if timings is None.
+    """
+    previous = getattr(_state, 'timings', None)
+    _state.timings = timings
+    try:
+        yield
+    finally:
+        _state.timings = previous
+
+
+def _frame_name(frame):
+    """
+    Returns the name of a frame in a collapsed stack: function (file:line).
+    """
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ',')
+
+
+def _sample(thread_id, stacks, stop, interval):
+    """
+    Counts the call stacks of a thread every interval seconds until stop is set.
+    """
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        if names:
+            stack = ';'.join(reversed(names))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+
+@contextmanager
+def profile_rerun(mode='Timings'):
+    """
+    Profiles the block (one rerun of the app) in the given mode of PROFILE_MODES:
+
+    - 'Off': nothing is recorded.
+    - 'Timings': the timed stages of the block.
+    - 'cProfile': the timings and a cProfile capture, as pstats bytes.
+    - 'Sampling': the timings and the call stacks sampled every SAMPLE_INTERVAL
+      seconds, in the collapsed format of flamegraph.pl and speedscope.
+
+    Yields a dict which holds, after the block, the 'timings', the total
+    'seconds', the 'pstats' or 'folded' capture and an 'error' if the
+    profiler could not start (only one cProfile can run at a time).
+    """
+    capture = {'mode': mode, 'timings': None, 'seconds': None, 'pstats': None, 'folded': None, 'error': None}
+    if mode == 'Off':
+        yield capture
+        return
+
+    _state.timings = capture['timings'] = []
+    profiler = sampler = None
+    if mode == 'cProfile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as error:
+            capture['error'] = str(error)
+            profiler = None
+    elif mode == 'Sampling':
+        stacks = {}
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sample, args=(threading.get_ident(), stacks, stop, SAMPLE_INTERVAL), daemon=True)
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield capture
+    finally:
+        capture['seconds'] = time.perf_counter() - start
+        _state.timings = None
+        if profiler is not None:
+            profiler.disable()
+            profiler.create_stats()
+            capture['pstats'] = marshal.dumps(profiler.stats)
+        if sampler is not None:
+            stop.set()
+            sampler.join()
+            capture['folded'] = ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
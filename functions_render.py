@@ -0,0 +1,147 @@
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+from functions_profile import timed
+
+
+# Memory budget of the rendered charts and options used to save them (the same as st.pyplot)
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+SAVEFIG_OPTIONS = {'format': 'png', 'dpi': 200, 'bbox_inches': 'tight'}
+
+# Widest image shown by the app: st.image scales wider images down to this width
+# (Streamlit's MAXIMUM_CONTENT_WIDTH) on every call, so the charts are scaled once when rendered
+DISPLAY_WIDTH = 1460
+
+# PNG bytes of the rendered charts from the least to the most recently used, and hit/miss counters
+_images = OrderedDict()
+_stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+_budget = [RENDER_CACHE_BYTES]
+_lock = threading.Lock()
+
+
+def _update_fingerprint(digest, value):
+    """
+    Adds a chart argument to a running digest. DataFrames, Series and arrays
+    are hashed by content, containers recursively and other values by repr.
+    """
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr((list(value.columns), list(value.dtypes))).encode())
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(repr((value.name, value.dtype)).encode())
+        digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}:{len(value)}'.encode())
+        for item in value:
+            _update_fingerprint(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f'dict:{len(value)}'.encode())
+        for key in sorted(value, key=repr):
+            _update_fingerprint(digest, key)
+            _update_fingerprint(digest, value[key])
+    else:
+        digest.update(repr(value).encode())
+
+
+def fingerprint(*values):
+    """
+    Returns a hex digest identifying the content of the given values.
+    """
+    digest = hashlib.sha256()
+    for value in values:
+        _update_fingerprint(digest, value)
+    return digest.hexdigest()
+
+
+def set_render_budget(max_bytes):
+    """
+    Sets the memory budget of the render cache, evicting the least recently used charts if needed.
+    """
+    with _lock:
+        _budget[0] = max_bytes
+        _evict()
+
+
+def _evict():
+    """
+    Drops the least recently used charts until the cache fits in its budget. Must hold _lock.
+    """
+    while _images and _stats['bytes'] > _budget[0]:
+        _, image = _images.popitem(last=False)
+        _stats['bytes'] -= len(image)
+
+
+def new_figure(**kwargs):
+    """
+    Returns a matplotlib Figure, not registered with pyplot. matplotlib is
+    imported on the first call, so importing the chart modules does not load it.
+    """
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
+
+
+def fit_width(image, max_width=DISPLAY_WIDTH):
+    """
+    Returns PNG bytes scaled down to max_width pixels wide, as st.image would
+    scale them (bilinear resampling), or the image itself if it is not wider.
+    """
+    from PIL import Image
+    picture = Image.open(io.BytesIO(image))
+    if picture.width <= max_width:
+        return image
+    height = int(1.0 * picture.height * max_width / picture.width)
+    buffer = io.BytesIO()
+    picture.resize((max_width, height), resample=Image.BILINEAR).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_chart(func, *args, **kwargs):
+    """
+    Returns the PNG bytes of the chart drawn by func(*args, **kwargs), no
+    wider than DISPLAY_WIDTH so st.image shows them without converting them.
+
+    The image is cached under the name of the function and a fingerprint of
+    its arguments (data and filter parameters), so a chart whose inputs did
+    not change is served from memory without calling matplotlib.
+    """
+    key = (func.__module__, func.__qualname__, fingerprint(args, kwargs))
+    with _lock:
+        if key in _images:
+            _images.move_to_end(key)
+            _stats['hits'] += 1
+            return _images[key]
+
+    # Draw the chart. The Figure is not registered with pyplot, so it is freed
+    # as soon as the last reference goes away after saving it
+    with timed('plot', func.__name__):
+        fig = func(*args, **kwargs)
+    buffer = io.BytesIO()
+    with timed('render', func.__name__):
+        fig.savefig(buffer, **SAVEFIG_OPTIONS)
+        del fig
+        image = fit_width(buffer.getvalue())
+
+    with _lock:
+        _stats['misses'] += 1
+        if key not in _images and len(image) <= _budget[0]:
+            _images[key] = image
+            _stats['bytes'] += len(image)
+            _evict()
+    return image
+
+
+def render_stats():
+    """
+    Returns the hit/miss counters, the number of charts and the bytes used by the render cache.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['charts'] = len(_images)
+        stats['budget'] = _budget[0]
+    return stats
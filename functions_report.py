@@ -0,0 +1,80 @@
+import json
+from functions_product import product_table, consume_wine, consume_m_w_by_age, consume_men_women, consume_by_age
+from functions_marketing import aggregate_marketing, site_purchases_by_age, site_purchases_by_income, web_visits_by_age, purchases_by_income, purchases_by_income_line, purchases_by_education, son_at_home, purchases_by_living_status, purchases_by_month
+from functions_click import slice_click_cube, click_by_category, click_by_category_income, click_by_category_age
+
+
+# Filters of the app used when a preset does not set them (None means no filter)
+DEFAULT_PRESET = {
+    'age': 'Total',                         # age range of the consumers pie chart
+    'ages': None,                           # age ranges of the consumers bar chart
+    'genre': 'Both',                        # 'Both', 'Men' or 'Women'
+    'wine_range': None,                     # amount spent on wine, marketing study
+    'income_range': None,                   # income of the purchases scatter plot
+    'click_income_range': [20000.0, 100000.0],
+    'click_age_range': [16, 64],
+    'zoom': [20, 70],
+}
+
+GENRES = ['Both', 'Men', 'Women']
+
+
+def load_presets(path):
+    """
+    Reads a JSON file mapping preset names to filters, e.g.
+    {"young": {"ages": ["16-24", "25-34"], "click_age_range": [16, 34]}},
+    and returns every preset completed with DEFAULT_PRESET.
+    """
+    with open(path) as f:
+        presets = json.load(f)
+    for name, preset in presets.items():
+        unknown = set(preset) - set(DEFAULT_PRESET)
+        if unknown:
+            raise ValueError(f'Unknown filters {sorted(unknown)} in preset {name!r}')
+    return {name: {**DEFAULT_PRESET, **preset} for name, preset in presets.items()}
+
+
+def _between(df, column, value_range):
+    """
+    Rows of df with column strictly inside value_range, as the sliders of the app filter them.
+    """
+    if value_range is None:
+        return df
+    return df[(df[column] > value_range[0]) & (df[column] < value_range[1])]
+
+
+def chart_plan(product_store, df_marketing, click_cube, preset=None):
+    """
+    Returns the (study, name, function, arguments) of every chart of the app,
+    with the filters of a preset (DEFAULT_PRESET if None) applied to the cleaned data.
+    The groupings of the marketing charts are computed once per preset (see
+    aggregate_marketing) and given to the charts instead of the customers.
+    """
+    preset = {**DEFAULT_PRESET, **(preset or {})}
+
+    # Filter the data as the widgets of the app do
+    df_both, df_men, df_women = (product_table(product_store, sex) for sex in GENRES)
+    df_age = df_both if preset['ages'] is None else df_both.loc[[age for age in df_both.index if age in preset['ages']]]
+    df_wine = _between(df_marketing, 'MntWines', preset['wine_range'])
+    df_income = _between(df_wine, 'Income', preset['income_range'])
+    wine_aggregates = aggregate_marketing(df_wine)
+    df_click = slice_click_cube(click_cube, preset['click_income_range'], preset['click_age_range'])
+    df_click_income = slice_click_cube(click_cube, preset['click_income_range'])
+    return [
+        ('product', 'consume_wine', consume_wine, (df_both.loc[[preset['age']]],)),
+        ('product', 'consume_by_age', consume_by_age, (df_age,)),
+        ('product', 'consume_m_w_by_age', consume_m_w_by_age, (df_men, df_women, GENRES.index(preset['genre']))),
+        ('product', 'consume_men_women', consume_men_women, (df_men, df_women)),
+        ('marketing', 'site_purchases_by_age', site_purchases_by_age, (wine_aggregates,)),
+        ('marketing', 'site_purchases_by_income', site_purchases_by_income, (wine_aggregates,)),
+        ('marketing', 'web_visits_by_age', web_visits_by_age, (wine_aggregates,)),
+        ('marketing', 'purchases_by_income', purchases_by_income, (df_income,)),
+        ('marketing', 'purchases_by_income_line', purchases_by_income_line, (df_income,)),
+        ('marketing', 'purchases_by_education', purchases_by_education, (wine_aggregates,)),
+        ('marketing', 'son_at_home', son_at_home, (wine_aggregates,)),
+        ('marketing', 'purchases_by_living_status', purchases_by_living_status, (wine_aggregates,)),
+        ('marketing', 'purchases_by_month', purchases_by_month, (wine_aggregates,)),
+        ('click', 'click_by_category', click_by_category, (df_click, preset['zoom'])),
+        ('click', 'click_by_category_income', click_by_category_income, (df_click,)),
+        ('click', 'click_by_category_age', click_by_category_age, (df_click_income,)),
+    ]
@@ -0,0 +1,34 @@
+import pandas as pd
+
+
+def _downcast_float(column):
+    """
+    Returns column as float32 if every value survives the round-trip exactly,
+    otherwise as float64 (pd.to_numeric also downcasts values it only finds close).
+    """
+    column = pd.to_numeric(column).astype('float64')
+    downcast = column.astype('float32')
+    return downcast if downcast.astype('float64').equals(column) else column
+
+
+def apply_schema(df, schema):
+    """
+    Returns a DataFrame with the columns of the schema, in its order, cast to their types.
+
+    The schema maps every column to a type, which can be:
+
+    - 'integer': the smallest integer width that holds all the values of the
+      column (checked with pd.to_numeric, so no value changes).
+    - 'float': float32 if every value of the column is exactly the same in
+      float32, otherwise float64.
+    - any other dtype understood by pandas, e.g. 'str' or a CategoricalDtype.
+    """
+    df = df[list(schema)].copy()
+    for column, dtype in schema.items():
+        if isinstance(dtype, str) and dtype == 'integer':
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif isinstance(dtype, str) and dtype == 'float':
+            df[column] = _downcast_float(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
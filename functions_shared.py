@@ -0,0 +1,103 @@
+import os
+import json
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+
+# Folder of the shared store: a tmpfs (RAM) folder shared by every process of the machine
+SHARED_DIR = os.environ.get('SHARED_STORE_DIR', '/dev/shm/marketing-study' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'marketing-study'))
+
+
+def shareable(value):
+    """
+    Returns True if a value can be published in the shared store: a DataFrame or a tuple of DataFrames.
+    """
+    if isinstance(value, tuple):
+        return len(value) > 0 and all(isinstance(item, pd.DataFrame) for item in value)
+    return isinstance(value, pd.DataFrame)
+
+
+def _to_table(df):
+    """
+    Converts a DataFrame to an Arrow table. Float columns keep NaN as a value
+    instead of a null, so they can be read back without copying.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    for i, field in enumerate(table.schema):
+        if field.name in df.columns and pd.api.types.is_float_dtype(df[field.name].dtype):
+            table = table.set_column(i, field, pa.array(df[field.name].to_numpy(), from_pandas=False))
+    return table
+
+
+def publish(key, value):
+    """
+    Writes a DataFrame, or a tuple of DataFrames, to SHARED_DIR as uncompressed
+    Arrow IPC files under key, and removes the entries of older keys with the
+    same name (the part of the key before the first '-').
+
+    The parts are written first and the manifest last, each one to a temporary
+    file renamed into place, so attach() never sees a partial entry.
+    """
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    frames = value if isinstance(value, tuple) else (value,)
+    for i, df in enumerate(frames):
+        table = _to_table(df)
+        path = os.path.join(SHARED_DIR, f'{key}.{i}.arrow')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    manifest = os.path.join(SHARED_DIR, f'{key}.json')
+    tmp_manifest = f'{manifest}.{os.getpid()}.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump({'parts': len(frames), 'tuple': isinstance(value, tuple)}, f)
+    os.replace(tmp_manifest, manifest)
+
+    # Drop the entries of older versions of the same name
+    name = key.split('-')[0] + '-'
+    for file_name in os.listdir(SHARED_DIR):
+        if file_name.startswith(name) and not file_name.startswith(key + '.'):
+            try:
+                os.remove(os.path.join(SHARED_DIR, file_name))
+            except FileNotFoundError:
+                # Already removed by another process
+                pass
+
+
+def attach(key):
+    """
+    Returns the value published under key, or None if there is none.
+
+    The files are memory-mapped, so numbers, strings and category codes are
+    views on pages shared by every process that attached them: they are
+    read-only and are not copied into the memory of the process.
+    """
+    try:
+        with open(os.path.join(SHARED_DIR, f'{key}.json')) as f:
+            manifest = json.load(f)
+        frames = []
+        for i in range(manifest['parts']):
+            source = pa.memory_map(os.path.join(SHARED_DIR, f'{key}.{i}.arrow'), 'r')
+            frames.append(ipc.open_file(source).read_all().to_pandas(split_blocks=True))
+    except (FileNotFoundError, pa.ArrowInvalid):
+        # Missing, or removed by a newer version while reading it
+        return None
+    return tuple(frames) if manifest['tuple'] else frames[0]
+
+
+def shared_stats():
+    """
+    Returns the number of entries and the bytes used by the shared store.
+    """
+    stats = {'entries': 0, 'bytes': 0}
+    if os.path.isdir(SHARED_DIR):
+        for file_name in os.listdir(SHARED_DIR):
+            if file_name.endswith('.json'):
+                stats['entries'] += 1
+            if file_name.endswith('.arrow'):
+                stats['bytes'] += os.path.getsize(os.path.join(SHARED_DIR, file_name))
+    return stats
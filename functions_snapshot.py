@@ -0,0 +1,156 @@
+import os
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+# Folder where the columnar snapshots of the datasets are written
+SNAPSHOT_DIR = 'datasets/snapshots'
+
+# Content hash of each source file
+_hashes = {}
+
+
+def file_hash(path):
+    """
+    Returns the sha256 hex digest of the content of a file.
+
+    The digest is remembered per path and only recomputed when the size
+    or the modification time of the file changes.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    if path in _hashes and _hashes[path][0] == signature:
+        return _hashes[path][1]
+
+    # Hash the file in blocks so big datasets are never fully loaded in memory
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+
+    _hashes[path] = (signature, digest.hexdigest())
+    return _hashes[path][1]
+
+
+def snapshot_path(path):
+    """
+    Returns the path of the Arrow snapshot of a dataset file.
+    """
+    return os.path.join(SNAPSHOT_DIR, os.path.basename(path) + '.arrow')
+
+
+def _encode_mixed(value):
+    """
+    Encodes a cell of a mixed-type column as a string tagged with its type.
+    """
+    if pd.isna(value):
+        return None
+    if isinstance(value, (int, float)):
+        return f'{type(value).__name__[0]}:{value!r}'
+    return f's:{value}'
+
+
+def _decode_mixed(value):
+    """
+    Decodes a cell encoded by _encode_mixed back to its int, float or str value.
+    """
+    if pd.isna(value):
+        return float('nan')
+    tag, text = value[0], value[2:]
+    if tag == 'i':
+        return int(text)
+    if tag == 'f':
+        return float(text)
+    return text
+
+
+def write_snapshot(path):
+    """
+    Converts a .csv, .xls or .xlsx dataset into an uncompressed Arrow IPC file in SNAPSHOT_DIR.
+
+    Columns mixing numbers and text (e.g. the INE consumers table) are stored
+    as tagged strings and restored to their original values when read.
+    The content hash of the source is saved in the schema metadata so that
+    read_snapshot() can detect when the snapshot is stale.
+    """
+    # Read the source with the same parser the study functions use
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+    else:
+        df = pd.read_excel(path)
+
+    # Encode the columns that Arrow cannot store with a single type
+    mixed = []
+    for column in df.columns:
+        if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+            df[column] = df[column].map(_encode_mixed).astype(object)
+            mixed.append(column)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'source_sha256': file_hash(path).encode(),
+        b'mixed_columns': '\x1f'.join(mixed).encode(),
+    })
+
+    # Write to a temporary file first so readers never map a partial snapshot
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    snapshot = snapshot_path(path)
+    tmp_file = f'{snapshot}.{os.getpid()}.tmp'
+    feather.write_feather(table, tmp_file, compression='uncompressed')
+    os.replace(tmp_file, snapshot)
+    return snapshot
+
+
+def read_snapshot(path, columns=None):
+    """
+    Reads the columns of a dataset from its memory-mapped Arrow snapshot.
+
+    columns is a list of column names or positions (None reads them all),
+    returned in the order of the source file. Returns None when there is
+    no snapshot for the file or when the file changed after the snapshot
+    was written, so the caller can fall back to parsing the source.
+    """
+    snapshot = snapshot_path(path)
+    if not os.path.exists(snapshot):
+        return None
+
+    with pa.memory_map(snapshot) as source:
+        reader = pa.ipc.open_file(source)
+        metadata = reader.schema.metadata or {}
+        if metadata.get(b'source_sha256') != file_hash(path).encode():
+            return None
+
+        # Only the buffers of the selected columns are touched in the mapped file
+        names = reader.schema.names
+        if columns is not None:
+            wanted = {names[c] if isinstance(c, int) else c for c in columns}
+            names = [name for name in names if name in wanted]
+        table = reader.read_all().select(names)
+        df = table.to_pandas()
+
+    # Restore the mixed-type columns
+    mixed = metadata.get(b'mixed_columns', b'').decode()
+    for column in mixed.split('\x1f') if mixed else []:
+        if column in df.columns:
+            df[column] = df[column].astype(object).map(_decode_mixed).astype(object)
+
+    return df
+
+
+def convert_datasets(folder='datasets'):
+    """
+    Writes the Arrow snapshot of every .csv, .xls and .xlsx file in a folder.
+    """
+    snapshots = []
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(('.csv', '.xls', '.xlsx')):
+            snapshots.append(write_snapshot(os.path.join(folder, file_name)))
+    return snapshots
+
+
+if __name__ == '__main__':
+    for snapshot in convert_datasets():
+        print(f'Written {snapshot}')
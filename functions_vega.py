@@ -0,0 +1,335 @@
+import os
+import pandas as pd
+from functions_marketing import DENSITY_MIN_ROWS, PURCHASE_COLUMNS, COHORT_VIEWS, COHORT_WINDOW, density_grid, linear_fit, cohort_view, chart_aggregates
+from functions_click import group_counts
+
+
+# Chart backend of the deployment: 'matplotlib' (PNG rendered on the server)
+# or 'vega' (Vega-Lite specs drawn and zoomed in the browser)
+CHART_BACKEND = os.environ.get('CHART_BACKEND', 'matplotlib')
+
+# Colors and labels shared with the matplotlib charts
+PURCHASE_COLORS = ['#a3c2c2', '#f2b5d4', '#c5a3ff', '#f6cfb7']
+PURCHASE_LABELS = ['Deals Purchases', 'Web Purchases', 'Catalog Purchases', 'Store Purchases']
+GENRE_COLORS = {'Men': '#a3c2c2', 'Women': '#f2b5d4'}
+MONTH_LABELS = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+
+# Lets the user zoom and pan the chart with the mouse, without rerunning the app
+ZOOM = {'name': 'zoom', 'select': 'interval', 'bind': 'scales'}
+
+
+def _records(df):
+    """
+    Returns the rows of df as JSON-ready dicts (missing values as None).
+    """
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _spec(df, **spec):
+    """
+    Returns a Vega-Lite spec drawing the rows of df, which fills the width of the page.
+    """
+    return {'data': {'values': _records(df)}, 'width': 'container', **spec}
+
+
+def _bars(df, x, y, x_title, y_title, color=None, sort=None, labels=None):
+    """
+    Spec of a bar chart of y by x, with an optional color field and value labels on top of the bars.
+    """
+    bar = {'mark': {'type': 'bar'}, 'encoding': {
+        'x': {'field': x, 'type': 'nominal', 'title': x_title, 'sort': sort, 'axis': {'labelAngle': 0}},
+        'y': {'field': y, 'type': 'quantitative', 'title': y_title},
+        'tooltip': [{'field': x, 'type': 'nominal'}, {'field': y, 'type': 'quantitative', 'format': '.2f'}],
+    }}
+    if color is not None:
+        bar['encoding']['color'] = {**color, 'legend': None} if 'field' in color else color
+    layers = [bar]
+    if labels is not None:
+        layers.append({'mark': {'type': 'text', 'dy': -8}, 'encoding': {
+            'x': bar['encoding']['x'], 'y': bar['encoding']['y'],
+            'text': {'field': y, 'type': 'quantitative', 'format': labels}}})
+    return _spec(df, layer=layers)
+
+
+def _grouped_bars(df, x, group, y, x_title, y_title, colors=None, sort=None, domain=None, legend_title=None):
+    """
+    Spec of bars of y by x, side by side for every value of group, with zoom and pan.
+    """
+    color = {'field': group, 'type': 'nominal', 'title': legend_title}
+    if colors is not None:
+        color['scale'] = {'domain': list(colors), 'range': list(colors.values())}
+    y_encoding = {'field': y, 'type': 'quantitative', 'title': y_title}
+    if domain is not None:
+        y_encoding['scale'] = {'domain': list(domain)}
+    return _spec(df, mark={'type': 'bar', 'clip': True}, params=[ZOOM], encoding={
+        'x': {'field': x, 'type': 'nominal', 'title': x_title, 'sort': sort, 'axis': {'labelAngle': 0}},
+        'xOffset': {'field': group, 'type': 'nominal', 'sort': list(colors) if colors else None},
+        'y': y_encoding,
+        'color': color,
+        'tooltip': [{'field': x, 'type': 'nominal'}, {'field': group, 'type': 'nominal'}, {'field': y, 'type': 'quantitative', 'format': '.2f'}],
+    })
+
+
+def _pie(labels, values, colors):
+    """
+    Spec of a pie chart with the percentage of every slice in its tooltip.
+    """
+    df = pd.DataFrame({'label': labels, 'value': values})
+    df['percentage'] = df['value'] / df['value'].sum() * 100
+    return _spec(df, mark={'type': 'arc'}, encoding={
+        'theta': {'field': 'value', 'type': 'quantitative'},
+        'color': {'field': 'label', 'type': 'nominal', 'title': None, 'scale': {'domain': list(labels), 'range': colors}},
+        'tooltip': [{'field': 'label', 'type': 'nominal'}, {'field': 'percentage', 'type': 'quantitative', 'format': '.1f', 'title': '%'}],
+    })
+
+
+def consume_wine_spec(df_both):
+    """
+    Vega-Lite version of consume_wine.
+    """
+    return _pie(['Consumers', 'Not consumers'], [df_both['total_cons'].iloc[0], df_both['0'].iloc[0]], ['#A3E4D7', '#FAD7A0'])
+
+
+def consume_by_age_spec(df_both):
+    """
+    Vega-Lite version of consume_by_age.
+    """
+    color = {'field': 'total_cons', 'type': 'quantitative', 'scale': {'scheme': 'viridis'}}
+    return _bars(df_both, 'years', 'total_cons', 'Age range', 'Total consumption (%)', color=color, labels='.2f')
+
+
+def consume_m_w_by_age_spec(df_men, df_women, x):
+    """
+    Vega-Lite version of consume_m_w_by_age.
+    """
+    genres = [genre for genre, excluded in [('Men', 2), ('Women', 1)] if x != excluded]
+    frames = {'Men': df_men, 'Women': df_women}
+    df = pd.concat([frames[genre].drop(index='Total').assign(genre=genre) for genre in genres])
+    encoding = {
+        'x': {'field': 'years', 'type': 'nominal', 'title': 'Age range', 'sort': None, 'axis': {'labelAngle': 0}},
+        'y': {'field': 'total_cons', 'type': 'quantitative', 'title': 'Consumers (%)'},
+        'color': {'field': 'genre', 'type': 'nominal', 'title': None,
+                  'scale': {'domain': genres, 'range': [GENRE_COLORS[genre] for genre in genres]}},
+    }
+    return _spec(df, encoding=encoding, layer=[
+        {'mark': {'type': 'line', 'point': True}, 'params': [ZOOM], 'encoding': {
+            'tooltip': [{'field': 'genre', 'type': 'nominal'}, {'field': 'years', 'type': 'nominal'}, {'field': 'total_cons', 'type': 'quantitative', 'format': '.2f'}]}},
+        {'mark': {'type': 'text', 'dy': -10}, 'encoding': {'text': {'field': 'total_cons', 'type': 'quantitative', 'format': '.2f'}}},
+    ])
+
+
+def consume_men_women_spec(df_men, df_women):
+    """
+    Vega-Lite version of consume_men_women.
+    """
+    df = pd.DataFrame({'genre': ['Men', 'Women'], 'total_cons': [
+        df_men.loc['Total', 'total_cons'],
+        df_women.loc['Total', 'total_cons'],
+    ]})
+    color = {'field': 'genre', 'type': 'nominal', 'scale': {'domain': list(GENRE_COLORS), 'range': list(GENRE_COLORS.values())}}
+    return _bars(df, 'genre', 'total_cons', None, 'Consumers (%)', color=color, labels='.2f')
+
+
+def _purchases_spec(grouped, key, x_title):
+    """
+    Grouped bars of the average purchases of every channel by key.
+    """
+    df = grouped.melt(id_vars=key, value_vars=PURCHASE_COLUMNS, var_name='Channel', value_name='Average')
+    df['Channel'] = df['Channel'].map(dict(zip(PURCHASE_COLUMNS, PURCHASE_LABELS)))
+    df[key] = df[key].astype('str')
+    return _grouped_bars(df, key, 'Channel', 'Average', x_title, 'Average purchases',
+                         colors=dict(zip(PURCHASE_LABELS, PURCHASE_COLORS)), sort=None)
+
+
+def site_purchases_by_age_spec(df_wine):
+    """
+    Vega-Lite version of site_purchases_by_age.
+    """
+    return _purchases_spec(chart_aggregates(df_wine)['purchases_by_age'], 'Age_Range', 'Age range')
+
+
+def site_purchases_by_income_spec(df_wine):
+    """
+    Vega-Lite version of site_purchases_by_income.
+    """
+    return _purchases_spec(chart_aggregates(df_wine)['purchases_by_income'], 'Income_Range', 'Range income')
+
+
+def web_visits_by_age_spec(df_wine):
+    """
+    Vega-Lite version of web_visits_by_age.
+    """
+    df = chart_aggregates(df_wine)['visits_by_age'].astype({'Age_Range': 'str'})
+    color = {'field': 'Age_Range', 'type': 'nominal', 'scale': {'scheme': 'pastel1'}}
+    return _bars(df, 'Age_Range', 'NumWebVisitsMonth', 'Age range', 'Average visits in the website', color=color)
+
+
+def _income_wine_layer(df_income):
+    """
+    Layer of the wine purchases against income: one point per customer, or
+    the non-empty bins of density_grid from DENSITY_MIN_ROWS customers, so the
+    data sent to the browser is bounded by the size of the grid.
+    """
+    axes = {'x': {'title': 'Incomes'}, 'y': {'title': 'Wine purchases'}}
+    if len(df_income) < DENSITY_MIN_ROWS:
+        return df_income[['Income', 'MntWines']].dropna(), {
+            'mark': {'type': 'point', 'filled': True, 'color': '#6a9ac4', 'stroke': 'black', 'strokeWidth': 0.5, 'opacity': 0.7},
+            'encoding': {'x': {'field': 'Income', 'type': 'quantitative', **axes['x']},
+                         'y': {'field': 'MntWines', 'type': 'quantitative', **axes['y']},
+                         'tooltip': [{'field': 'Income', 'type': 'quantitative'}, {'field': 'MntWines', 'type': 'quantitative'}]}}
+
+    counts, x_edges, y_edges = density_grid(df_income['Income'], df_income['MntWines'])
+    x_bins, y_bins = counts.nonzero()
+    df = pd.DataFrame({'Income': x_edges[x_bins], 'Income_end': x_edges[x_bins + 1],
+                       'MntWines': y_edges[y_bins], 'MntWines_end': y_edges[y_bins + 1], 'Customers': counts[x_bins, y_bins]})
+    return df, {
+        'mark': {'type': 'rect'},
+        'encoding': {'x': {'field': 'Income', 'type': 'quantitative', **axes['x']}, 'x2': {'field': 'Income_end'},
+                     'y': {'field': 'MntWines', 'type': 'quantitative', **axes['y']}, 'y2': {'field': 'MntWines_end'},
+                     'color': {'field': 'Customers', 'type': 'quantitative', 'scale': {'type': 'log', 'scheme': 'blues'}},
+                     'tooltip': [{'field': 'Customers', 'type': 'quantitative'}]}}
+
+
+def purchases_by_income_spec(df_income):
+    """
+    Vega-Lite version of purchases_by_income.
+    """
+    df, layer = _income_wine_layer(df_income)
+    return _spec(df, params=[ZOOM], **layer)
+
+
+def purchases_by_income_line_spec(df_income):
+    """
+    Vega-Lite version of purchases_by_income_line: the points or density
+    grid, the regression line and its 95% confidence band.
+    """
+    df, layer = _income_wine_layer(df_income)
+    layers = [{**layer, 'params': [ZOOM]}]
+    fit = linear_fit(df_income['Income'], df_income['MntWines'])
+    if fit is not None:
+        line = pd.DataFrame({'Income': fit['x'], 'Fit': fit['y'], 'Lower': fit['lower'], 'Upper': fit['upper']})
+        title = f"y = {fit['slope']:.4f}x {'+' if fit['intercept'] >= 0 else '-'} {abs(fit['intercept']):.1f}, R² = {fit['r2']:.3f}"
+        layers += [
+            {'data': {'values': _records(line)}, 'mark': {'type': 'area', 'color': 'red', 'opacity': 0.15},
+             'encoding': {'x': {'field': 'Income', 'type': 'quantitative'}, 'y': {'field': 'Lower', 'type': 'quantitative'}, 'y2': {'field': 'Upper'}}},
+            {'data': {'values': _records(line)}, 'mark': {'type': 'line', 'color': 'red', 'strokeWidth': 2},
+             'encoding': {'x': {'field': 'Income', 'type': 'quantitative'}, 'y': {'field': 'Fit', 'type': 'quantitative'}}},
+        ]
+        return _spec(df, title=title, layer=layers)
+    return _spec(df, layer=layers)
+
+
+def purchases_by_education_spec(df):
+    """
+    Vega-Lite version of purchases_by_education.
+    """
+    education_mean = chart_aggregates(df)['wine_by_education'].sort_values(by='MntWines')
+    color = {'field': 'Education_Level', 'type': 'nominal', 'scale': {'scheme': 'pastel1'}}
+    return _bars(education_mean, 'Education_Level', 'MntWines', 'Education level', 'Average purchases wine', color=color, sort=None)
+
+
+def son_at_home_spec(df):
+    """
+    Vega-Lite version of son_at_home.
+    """
+    parent_mean = chart_aggregates(df)['wine_by_parent']
+    labels = parent_mean['Is_Parent'].map({0: 'Not son at home', 1: 'Son at home'})
+    return _pie(list(labels), list(parent_mean['MntWines']), ['#ff9999', '#66b3ff'][:len(labels)])
+
+
+def purchases_by_living_status_spec(df):
+    """
+    Vega-Lite version of purchases_by_living_status.
+    """
+    color = {'field': 'Living_Status', 'type': 'nominal', 'scale': {'scheme': 'pastel1'}}
+    return _bars(chart_aggregates(df)['wine_by_living_status'], 'Living_Status', 'MntWines', 'Living status', 'Average purchases wine', color=color, labels='.2f')
+
+
+def purchases_by_month_spec(df, view=COHORT_VIEWS[0]):
+    """
+    Vega-Lite version of purchases_by_month.
+    """
+    sales = cohort_view(chart_aggregates(df)['cohort_daily'], view)
+    color = {'value': '#4a90e2'}
+    if view == 'Month of year':
+        sales['Month_Name'] = [MONTH_LABELS[month - 1] for month in sales['Period']]
+        return _bars(sales, 'Month_Name', 'MntWines', 'Month', 'Total purchases wine', color=color, sort=MONTH_LABELS)
+
+    # Dates as ISO strings, bucketed again by the time unit of the view
+    sales['Period'] = sales['Period'].dt.strftime('%Y-%m-%d')
+    y_title = 'Total purchases wine' if view != COHORT_VIEWS[-1] else f'Purchases wine, last {COHORT_WINDOW} days'
+    time_unit = {'Calendar month': 'yearmonth', 'Quarter': 'yearquarter'}.get(view, 'yearmonthdate')
+    return _spec(sales, mark={'type': 'bar' if view in ('Calendar month', 'Quarter') else 'line', 'color': '#4a90e2'}, params=[ZOOM], encoding={
+        'x': {'field': 'Period', 'type': 'temporal', 'timeUnit': time_unit, 'title': 'Enrollment date'},
+        'y': {'field': 'MntWines', 'type': 'quantitative', 'title': y_title},
+        'tooltip': [{'field': 'Period', 'type': 'temporal', 'timeUnit': time_unit}, {'field': 'MntWines', 'type': 'quantitative', 'format': '.0f'},
+                    {'field': 'Customers', 'type': 'quantitative', 'format': '.0f'}],
+    })
+
+
+def _click_percentages(df, key):
+    """
+    Percentage of clicks of every category by key, in long format.
+    """
+    counts = group_counts(df, [key, 'Interest_Category', 'Click']).unstack(fill_value=0).reindex(columns=[0, 1], fill_value=0)
+    percentages = (counts[1] / (counts[0] + counts[1]) * 100).rename('Percentage_Click').reset_index()
+    percentages[key] = percentages[key].astype('str')
+    return percentages.dropna()
+
+
+def click_by_category_spec(df, size):
+    """
+    Vega-Lite version of click_by_category. size is only the initial range of
+    the y axis: the user zooms in the browser.
+    """
+    counts = group_counts(df, ['Interest_Category', 'Click']).unstack(fill_value=0).reindex(columns=[0, 1], fill_value=0)
+    percentages = counts.div(counts.sum(axis=1), axis=0) * 100
+    percentages.columns = ['No Click', 'Click']
+    long = percentages.reset_index().melt(id_vars='Interest_Category', var_name='Click', value_name='Percentage')
+    return _grouped_bars(long, 'Interest_Category', 'Click', 'Percentage', 'Category', 'Percentage (%)',
+                         colors={'No Click': '#d9e6f2', 'Click': '#4a90e2'}, domain=size, legend_title='Click')
+
+
+def click_by_category_income_spec(df):
+    """
+    Vega-Lite version of click_by_category_income.
+    """
+    return _grouped_bars(_click_percentages(df, 'Income_Range'), 'Income_Range', 'Interest_Category', 'Percentage_Click',
+                         'Income range', 'Click (%)', domain=[39, 61], legend_title='Category')
+
+
+def click_by_category_age_spec(df):
+    """
+    Vega-Lite version of click_by_category_age.
+    """
+    return _grouped_bars(_click_percentages(df, 'Age_Range'), 'Age_Range', 'Interest_Category', 'Percentage_Click',
+                         'Age range', 'Click (%)', domain=[40, 60], legend_title='Category')
+
+
+# Vega-Lite version of every chart function, by name
+VEGA_SPECS = {
+    'consume_wine': consume_wine_spec,
+    'consume_by_age': consume_by_age_spec,
+    'consume_m_w_by_age': consume_m_w_by_age_spec,
+    'consume_men_women': consume_men_women_spec,
+    'site_purchases_by_age': site_purchases_by_age_spec,
+    'site_purchases_by_income': site_purchases_by_income_spec,
+    'web_visits_by_age': web_visits_by_age_spec,
+    'purchases_by_income': purchases_by_income_spec,
+    'purchases_by_income_line': purchases_by_income_line_spec,
+    'purchases_by_education': purchases_by_education_spec,
+    'son_at_home': son_at_home_spec,
+    'purchases_by_living_status': purchases_by_living_status_spec,
+    'purchases_by_month': purchases_by_month_spec,
+    'click_by_category': click_by_category_spec,
+    'click_by_category_income': click_by_category_income_spec,
+    'click_by_category_age': click_by_category_age_spec,
+}
+
+
+def vega_spec(func, *args):
+    """
+    Returns the Vega-Lite spec of the chart drawn by func(*args), or None if func has no Vega-Lite version.
+    """
+    spec = VEGA_SPECS.get(func.__name__)
+    return spec(*args) if spec is not None else None
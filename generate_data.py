@@ -0,0 +1,229 @@
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+# Rows generated by each worker task and largest sheet an .xlsx file can hold
+CHUNK_ROWS = 1000000
+XLSX_MAX_ROWS = 1048575
+
+# Category frequencies measured on the bundled datasets
+CLICK_CATEGORIES = {
+    'Gender': {'Female': 0.507, 'Male': 0.493},
+    'Location': {'Suburban': 0.344, 'Urban': 0.33, 'Rural': 0.326},
+    'Device': {'Mobile': 0.344, 'Tablet': 0.336, 'Desktop': 0.32},
+    'Interest_Category': {'Technology': 0.278, 'Sports': 0.248, 'Travel': 0.24, 'Fashion': 0.234},
+}
+MARKETING_CATEGORIES = {
+    'Education': {'Graduation': 0.5031, 'PhD': 0.217, 'Master': 0.1652, '2n Cycle': 0.0906, 'Basic': 0.0241},
+    'Marital_Status': {'Married': 0.3857, 'Together': 0.2589, 'Single': 0.2143, 'Divorced': 0.1036, 'Widow': 0.0344,
+                       'Alone': 0.0013, 'Absurd': 0.0009, 'YOLO': 0.0009},
+}
+
+# Median, log-normal spread and maximum of the amounts spent per product
+MARKETING_AMOUNTS = {
+    'MntWines': (173, 1.1, 1493),
+    'MntFruits': (8, 1.5, 199),
+    'MntMeatProducts': (67, 1.35, 1725),
+    'MntFishProducts': (12, 1.5, 259),
+    'MntSweetProducts': (8, 1.5, 263),
+    'MntGoldProds': (24, 1.1, 362),
+}
+
+# Acceptance rate of each campaign, complaints and response
+MARKETING_RATES = {
+    'AcceptedCmp3': 0.0728, 'AcceptedCmp4': 0.0746, 'AcceptedCmp5': 0.0728, 'AcceptedCmp1': 0.0643,
+    'AcceptedCmp2': 0.0134, 'Complain': 0.0094, 'Response': 0.1491,
+}
+
+
+def _choice(rng, frequencies, size):
+    """
+    Draws size values of a category with the given frequencies.
+    """
+    labels = list(frequencies)
+    p = np.array(list(frequencies.values()))
+    return np.asarray(labels, dtype=object)[rng.choice(len(labels), size=size, p=p / p.sum())]
+
+
+def generate_click(rng, start, size):
+    """
+    Generates size rows of adsclicking.csv, numbered from start.
+
+    Age, income, time on site and pages viewed are uniform over the ranges
+    of the bundled dataset, the categories follow its frequencies and half
+    of the ads are clicked.
+    """
+    df = pd.DataFrame({'Unnamed: 0': np.arange(start, start + size)})
+    df['Age'] = rng.integers(18, 65, size)
+    df['Gender'] = _choice(rng, CLICK_CATEGORIES['Gender'], size)
+    df['Income'] = rng.integers(20000, 100000, size)
+    df['Location'] = _choice(rng, CLICK_CATEGORIES['Location'], size)
+    df['Device'] = _choice(rng, CLICK_CATEGORIES['Device'], size)
+    df['Interest_Category'] = _choice(rng, CLICK_CATEGORIES['Interest_Category'], size)
+    df['Time_Spent_on_Site'] = rng.uniform(5, 120, size)
+    df['Number_of_Pages_Viewed'] = rng.integers(1, 20, size)
+    df['Click'] = (rng.random(size) < 0.497).astype(int)
+    return df
+
+
+def generate_marketing(rng, start, size):
+    """
+    Generates size rows of marketing_campaign.xlsx, with IDs from start.
+
+    Income is log-normal, and a spending factor correlated with income (about 0.6
+    as in the bundled dataset) drives the amounts spent and the purchases in
+    every channel, so the income/wine relation and the channel averages look
+    like the real ones.
+    """
+    df = pd.DataFrame({'ID': np.arange(start, start + size)})
+    df['Year_Birth'] = np.clip(np.rint(rng.normal(1969, 12, size)), 1940, 1996).astype(int)
+    df['Education'] = _choice(rng, MARKETING_CATEGORIES['Education'], size)
+    df['Marital_Status'] = _choice(rng, MARKETING_CATEGORIES['Marital_Status'], size)
+
+    # Income with 1% of missing values, and the spending factor
+    income = np.clip(np.rint(51400 * np.exp(rng.normal(0, 0.5, size))), 1730, 160000)
+    income[rng.random(size) < 0.0107] = np.nan
+    df['Income'] = income
+    wealth = np.nan_to_num((np.log(income) - np.log(51400)) / 0.5)
+    spending = 0.7 * wealth + 0.71 * rng.normal(0, 1, size)
+
+    df['Kidhome'] = rng.choice(3, size=size, p=[0.58, 0.40, 0.02])
+    df['Teenhome'] = rng.choice(3, size=size, p=[0.52, 0.46, 0.02])
+    first_day = np.datetime64('2012-07-30')
+    days = (np.datetime64('2014-06-29') - first_day).astype(int)
+    df['Dt_Customer'] = np.datetime_as_string(first_day + rng.integers(0, days + 1, size), unit='D')
+    df['Recency'] = rng.integers(0, 100, size)
+
+    for column, (median, spread, maximum) in MARKETING_AMOUNTS.items():
+        amount = median * np.exp(spread * (0.85 * spending + 0.5 * rng.normal(0, 1, size)))
+        df[column] = np.clip(np.rint(amount), 0, maximum).astype(int)
+
+    df['NumDealsPurchases'] = np.minimum(rng.poisson(2.3, size), 15)
+    df['NumWebPurchases'] = np.minimum(rng.poisson(np.clip(4.1 + 1.5 * spending, 0.5, None)), 27)
+    df['NumCatalogPurchases'] = np.minimum(rng.poisson(np.clip(2.7 + 2.0 * spending, 0.1, None)), 28)
+    df['NumStorePurchases'] = np.minimum(rng.poisson(np.clip(5.8 + 2.5 * spending, 0.5, None)), 13)
+    df['NumWebVisitsMonth'] = np.minimum(rng.poisson(np.clip(5.3 - 1.2 * wealth, 0.5, None)), 20)
+
+    for column, rate in MARKETING_RATES.items():
+        df[column] = (rng.random(size) < rate).astype(int)
+
+    # Constant columns of the original file, placed where they are in it
+    df.insert(df.columns.get_loc('Complain') + 1, 'Z_CostContact', 3)
+    df.insert(df.columns.get_loc('Z_CostContact') + 1, 'Z_Revenue', 11)
+    return df
+
+
+GENERATORS = {'click': generate_click, 'marketing': generate_marketing}
+
+
+def _chunk_plan(rows, seed):
+    """
+    Returns the (start, size, seed sequence) of every chunk. Each chunk gets its
+    own child of the seed, so the output does not depend on the number of workers.
+    """
+    starts = range(0, rows, CHUNK_ROWS)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    return [(start, min(CHUNK_ROWS, rows - start), child) for start, child in zip(starts, seeds)]
+
+
+def _generate_chunk(dataset, start, size, seed):
+    """
+    Generates one chunk of a dataset.
+    """
+    return GENERATORS[dataset](np.random.default_rng(seed), start, size)
+
+
+def _write_part(dataset, start, size, seed, path, file_format):
+    """
+    Generates one chunk of a dataset and writes it to a part file. Runs in a worker process.
+    """
+    df = _generate_chunk(dataset, start, size, seed)
+    if file_format == 'csv':
+        df.to_csv(path, index=False, header=start == 0)
+    else:
+        df.to_parquet(path, index=False)
+    return path
+
+
+def generate(dataset, rows, path, seed=0, workers=None):
+    """
+    Writes a synthetic version of a dataset ('click' or 'marketing') with the
+    given number of rows to path. The format is taken from the extension
+    (.csv, .parquet or .xlsx). The same seed always produces the same file.
+
+    Chunks of CHUNK_ROWS rows are generated in parallel by a process pool and
+    written to part files, which are then joined into the output file.
+    """
+    file_format = os.path.splitext(path)[1].lstrip('.')
+    if dataset not in GENERATORS:
+        raise ValueError(f'Unknown dataset {dataset!r}, use one of {sorted(GENERATORS)}')
+    if file_format not in ('csv', 'parquet', 'xlsx'):
+        raise ValueError(f'Unsupported format {file_format!r}, use .csv, .parquet or .xlsx')
+    if file_format == 'xlsx' and rows > XLSX_MAX_ROWS:
+        raise ValueError(f'An .xlsx sheet holds at most {XLSX_MAX_ROWS} rows, use .csv or .parquet')
+
+    plan = _chunk_plan(rows, seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # Excel files are written in one go, the sheet cannot be appended by parts
+    if file_format == 'xlsx':
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(pool.map(_generate_chunk, [dataset] * len(plan), *zip(*plan)))
+        pd.concat(chunks, ignore_index=True).to_excel(path, index=False)
+        return path
+
+    folder = tempfile.mkdtemp(prefix='generate-', dir=os.path.dirname(path) or '.')
+    try:
+        parts = [os.path.join(folder, f'part-{i:05d}.{file_format}') for i in range(len(plan))]
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_write_part, dataset, start, size, child, part, file_format)
+                       for (start, size, child), part in zip(plan, parts)]
+            for future in futures:
+                future.result()
+
+        # Join the parts without loading more than one of them at a time
+        if file_format == 'csv':
+            with open(path, 'wb') as output:
+                for part in parts:
+                    with open(part, 'rb') as f:
+                        shutil.copyfileobj(f, output)
+        else:
+            import pyarrow.parquet as pq
+            writer = None
+            for part in parts:
+                table = pq.read_table(part)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            writer.close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return path
+
+
+def main(argv=None):
+    """
+    Command line entry point, e.g. python generate_data.py click 1000000 -o datasets/synthetic/adsclicking.csv
+    """
+    parser = argparse.ArgumentParser(description='Generate synthetic versions of the study datasets.')
+    parser.add_argument('dataset', choices=sorted(GENERATORS), help='dataset to imitate')
+    parser.add_argument('rows', type=int, help='number of rows to generate')
+    parser.add_argument('-o', '--output', required=True, help='output file (.csv, .parquet or .xlsx)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--workers', type=int, default=None, help='processes used to generate the chunks')
+    args = parser.parse_args(argv)
+
+    if args.rows < 1:
+        parser.error('rows must be at least 1')
+    print(generate(args.dataset, args.rows, args.output, args.seed, args.workers))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
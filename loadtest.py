@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# App driven by the simulated sessions, file where the results of every run are
+# appended and seconds a rerun can take before it is counted as failed
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+LOADTEST_PATH = 'benchmarks/loadtest.jsonl'
+RERUN_TIMEOUT = 300
+
+# Percentiles of the rerun latency reported for every number of sessions
+PERCENTILES = [50, 95, 99]
+
+
+def _widget(widgets, label):
+    """
+    Returns the first widget with the given label, or None if the app does not show it.
+    """
+    return next((widget for widget in widgets if widget.label == label), None)
+
+
+def _random_range(rng, low, high):
+    """
+    Returns a random (low, high) integer range inside the given bounds.
+    """
+    ends = sorted(rng.sample(range(int(low), int(high) + 1), 2))
+    return (ends[0], ends[1])
+
+
+def move_wine_range(at, rng):
+    """
+    Moves the wine slider of the sidebar to a random range (reruns the whole app).
+    """
+    slider = _widget(at.sidebar.slider, 'Select range of total amount spent on wine')
+    if slider is None:
+        return False
+    slider.set_value(_random_range(rng, slider.min, slider.max))
+    return True
+
+
+def toggle_linear_fit(at, rng):
+    """
+    Ticks or unticks the linear fit of the income scatter plot.
+    """
+    checkbox = _widget(at.checkbox, 'Linear fit')
+    if checkbox is None:
+        return False
+    checkbox.set_value(not checkbox.value)
+    return True
+
+
+def move_zoom_range(at, rng):
+    """
+    Moves the zoom slider of the click chart to a random range (not shown with the Vega-Lite backend).
+    """
+    slider = _widget(at.slider, 'Select size zoom')
+    if slider is None:
+        return False
+    slider.set_value(_random_range(rng, slider.min, slider.max))
+    return True
+
+
+# Widget interactions replayed by the sessions, chosen at random
+INTERACTIONS = {
+    'wine_range': move_wine_range,
+    'linear_fit': toggle_linear_fit,
+    'zoom_range': move_zoom_range,
+}
+
+
+def run_session(seed, interactions, think, start):
+    """
+    Simulates one analyst: opens the app with AppTest once start is set, then
+    replays interactions random widget interactions, waiting a random time of
+    0 to 2 * think seconds before each one.
+
+    Returns a list of {'action', 'seconds', 'error'} with every rerun, the
+    first one being 'open'. AppTest reruns the whole script, so interactions
+    with a fragment are measured as full reruns.
+    """
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(seed)
+    at = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT)
+    reruns = []
+
+    def rerun(action):
+        started = time.perf_counter()
+        try:
+            at.run()
+            error = len(at.exception) > 0
+        except RuntimeError:
+            # The rerun timed out
+            error = True
+        reruns.append({'action': action, 'seconds': time.perf_counter() - started, 'error': error})
+
+    start.wait()
+    rerun('open')
+    for _ in range(interactions):
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+        actions = list(INTERACTIONS)
+        rng.shuffle(actions)
+        for action in actions:
+            if INTERACTIONS[action](at, rng):
+                rerun(action)
+                break
+    return reruns
+
+
+def _peak_memory_mb():
+    """
+    Returns the peak resident memory of this process in MB (ru_maxrss is in KB on Linux and in bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_level(sessions, interactions, think, seed):
+    """
+    Runs sessions simulated sessions at the same time in threads of this process,
+    as a Streamlit server runs the reruns of its sessions, after one session
+    that warms the data and chart caches up.
+
+    Returns a dict with the number of reruns and failed reruns, the throughput
+    (reruns per second), the percentiles of the latency of the interactions,
+    the median time to open the app and the peak memory of the process.
+    """
+    warm_up = threading.Event()
+    warm_up.set()
+    run_session(seed - 1, 0, 0, warm_up)
+
+    start = threading.Event()
+    with ThreadPoolExecutor(sessions) as pool:
+        futures = [pool.submit(run_session, seed + i, interactions, think, start) for i in range(sessions)]
+        started = time.perf_counter()
+        start.set()
+        reruns = [rerun for future in futures for rerun in future.result()]
+    seconds = time.perf_counter() - started
+
+    latencies = [rerun['seconds'] for rerun in reruns if rerun['action'] != 'open']
+    opens = [rerun['seconds'] for rerun in reruns if rerun['action'] == 'open']
+    result = {
+        'sessions': sessions,
+        'reruns': len(reruns),
+        'errors': sum(rerun['error'] for rerun in reruns),
+        'seconds': seconds,
+        'throughput': len(reruns) / seconds,
+        'open_p50': float(np.percentile(opens, 50)),
+        'peak_mb': _peak_memory_mb(),
+    }
+    for q in PERCENTILES:
+        result[f'p{q}'] = float(np.percentile(latencies, q)) if latencies else None
+    return result
+
+
+def main(argv=None):
+    """
+    Runs the load test for every number of sessions, each one in a new Python
+    process so its peak memory is measured alone, prints the results and
+    appends them to the history file. Returns 1 if any rerun failed.
+    """
+    parser = argparse.ArgumentParser(description='Measure the rerun latency of the app with many simultaneous sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of simultaneous sessions')
+    parser.add_argument('--interactions', type=int, default=10, help='widget interactions of every session')
+    parser.add_argument('--think', type=float, default=0.0, help='average seconds a session waits before each interaction')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the interactions')
+    parser.add_argument('--history', default=LOADTEST_PATH, help='JSON lines file where the results are appended')
+    parser.add_argument('--level', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Worker process: run one number of sessions and print the result
+    if args.level is not None:
+        print(json.dumps(run_level(args.level, args.interactions, args.think, args.seed)))
+        return 0
+
+    from benchmark import git_commit
+    run = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version(),
+           'chart_backend': os.environ.get('CHART_BACKEND', 'matplotlib'), 'query_backend': os.environ.get('QUERY_BACKEND', 'pandas'),
+           'interactions': args.interactions, 'think': args.think}
+
+    results = []
+    print(f"{'sessions':>8}{'reruns':>8}{'errors':>8}{'reruns/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'open p50':>10}{'peak MB':>9}")
+    for sessions in args.sessions:
+        command = [sys.executable, os.path.abspath(__file__), '--level', str(sessions), '--interactions', str(args.interactions),
+                   '--think', str(args.think), '--seed', str(args.seed)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True, cwd=os.path.dirname(APP_PATH)).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        latencies = ''.join(f"{result[f'p{q}']:>9.3f}" if result[f'p{q}'] is not None else f"{'-':>9}" for q in PERCENTILES)
+        print(f"{sessions:>8}{result['reruns']:>8}{result['errors']:>8}{result['throughput']:>10.2f}{latencies}"
+              f"{result['open_p50']:>10.3f}{result['peak_mb']:>9.0f}")
+
+    os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+    with open(args.history, 'a') as f:
+        for result in results:
+            f.write(json.dumps({**run, **result}) + '\n')
+
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
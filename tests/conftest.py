@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+
+# The modules of the app and the datasets folder are at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def repository_root():
+    """
+    Runs the tests from the root of the repository, where the dataset paths are relative to.
+    """
+    previous = os.getcwd()
+    os.chdir(ROOT)
+    yield ROOT
+    os.chdir(previous)
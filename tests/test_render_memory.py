@@ -0,0 +1,74 @@
+import os
+import gc
+import itertools
+import statistics
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from functions_render import RENDER_CACHE_BYTES, render_chart, render_stats, set_render_budget
+from functions_report import chart_plan
+
+
+# Charts rendered by the test (cycling over the plan), charts between two samples
+# of the memory, and growth of the memory allowed from the first to the second half
+RENDER_CALLS = int(os.environ.get('RENDER_TEST_CALLS', 1000))
+SAMPLE_EVERY = 16
+MAX_GROWTH_MB = 20
+
+
+def _rss_mb():
+    """
+    Returns the current resident memory of this process in MB.
+    """
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    psutil = pytest.importorskip('psutil')
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+@pytest.fixture(scope='module')
+def plan():
+    from functions_cache import load_product, load_marketing, load_click_cube
+    return chart_plan(load_product(), load_marketing(), load_click_cube())
+
+
+@pytest.fixture
+def no_render_cache():
+    """
+    Disables the render cache, so every render_chart call draws and renders its chart.
+    """
+    set_render_budget(0)
+    yield
+    set_render_budget(RENDER_CACHE_BYTES)
+
+
+def test_charts_are_not_registered_with_pyplot(plan, no_render_cache):
+    for _, _, func, args in plan:
+        render_chart(func, *args)
+    assert plt.get_fignums() == []
+
+
+def test_rendering_does_not_grow_memory(plan, no_render_cache):
+    # Render every chart once first, so the warm-up of matplotlib (fonts, caches)
+    # is not counted as growth
+    for _, _, func, args in plan:
+        render_chart(func, *args)
+
+    misses = render_stats()['misses']
+    samples = []
+    for i, (_, _, func, args) in enumerate(itertools.islice(itertools.cycle(plan), RENDER_CALLS)):
+        render_chart(func, *args)
+        if (i + 1) % SAMPLE_EVERY == 0:
+            gc.collect()
+            samples.append(_rss_mb())
+
+    assert render_stats()['misses'] - misses == RENDER_CALLS
+    assert plt.get_fignums() == []
+
+    # The growth is measured between the medians of the two halves of the run,
+    # which are less sensitive to a single sample than the first and last ones
+    half = len(samples) // 2
+    growth = statistics.median(samples[half:]) - statistics.median(samples[:half])
+    assert growth < MAX_GROWTH_MB, f'memory grew by {growth:.1f} MB over {RENDER_CALLS} renders'